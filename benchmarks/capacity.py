@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Check that the capacity report is the same on a cold and on a cached run.
+
+The cold run cleans the raw workbook, the cached run reads the cleaned CSV the
+cold run wrote. Both use a temporary directory for the cleaned data, so an
+existing cache is neither used nor changed. The check fails if the reports or
+the issue counts differ.
+
+Run it from the repository root with python -m benchmarks.capacity, optionally
+with the path of a raw workbook. The results are stored in
+reports/capacity_cache.json.
+"""
+
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from parser import clean
+from parser.capacity import ISSUES, get_capacity_reconciliation
+
+OUTPUT_FILE = Path("reports/capacity_cache.json")
+
+
+def get_report(filename: str | None):
+    """Return the flagged columns as CSV, the issue counts and the run time."""
+    start = time.perf_counter()
+    df, _, _ = clean.get_clean_data(filename, keep_declared_points=True)
+    table = get_capacity_reconciliation(df)
+    run_time = time.perf_counter() - start
+    flagged = table[table[ISSUES].any(axis=1)]
+    counts = {issue: int(count) for issue, count in table[ISSUES].sum().items()}
+    return flagged.to_csv(index=False), counts, run_time
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    with tempfile.TemporaryDirectory() as fair_dir:
+        clean.FAIRDIR = fair_dir
+        cold_report, cold_counts, cold_time = get_report(filename)
+        cached_report, cached_counts, cached_time = get_report(filename)
+
+    errors = [
+        f"{issue}: {cold_counts[issue]} cold, {cached_counts[issue]} cached"
+        for issue in ISSUES
+        if cold_counts[issue] != cached_counts[issue]
+    ]
+    if cold_report != cached_report and not errors:
+        errors.append("The flagged columns differ")
+    results = {
+        "cold": {"issues": cold_counts, "run_time": cold_time},
+        "cached": {"issues": cached_counts, "run_time": cached_time},
+        "errors": errors,
+    }
+    print(f"cold {cold_time:.2f} s, cached {cached_time:.2f} s")
+    OUTPUT_FILE.parent.mkdir(exist_ok=True, parents=True)
+    OUTPUT_FILE.write_text(json.dumps(results, indent=4))
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Measure the import time of every stage with python -X importtime.
+
+Run it from the repository root, the results are stored in reports/importtime.json
+and compared with the results of the previous run.
+"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ENTRY_POINTS = [
+    "parser.load",
+    "parser.clean",
+    "parser.annotate",
+    "parser.normalise",
+    "parser.rename",
+    "parser.evaluate",
+    "parser.validate",
+    "parser.aggregate",
+    "parser.publish_normalised",
+    "parser.bundle",
+    "parser.evse",
+    "parser.partition",
+    "parser.operators",
+    "parser.serve",
+    "parser.history",
+    "parser.shared",
+    "parser.capacity",
+    "parser.tiles",
+]
+REPEAT = 5
+OUTPUT_FILE = Path("reports/importtime.json")
+
+
+def get_import_time(module: str):
+    """Return the cumulative import time of a module in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if name.strip() == module:
+            return int(cumulative)
+    raise ValueError(f"{module} not found in the import time output")
+
+
+def main():
+    previous = {}
+    if OUTPUT_FILE.exists():
+        previous = json.loads(OUTPUT_FILE.read_text())
+
+    results = {}
+    for module in ENTRY_POINTS:
+        # The fastest run is the least disturbed by the rest of the system
+        results[module] = min(get_import_time(module) for _ in range(REPEAT))
+        change = ""
+        if module in previous:
+            change = f"{(results[module] - previous[module]) / 1000:+10.1f} ms"
+        print(f"{module:30} {results[module] / 1000:10.1f} ms {change}")
+
+    OUTPUT_FILE.parent.mkdir(exist_ok=True, parents=True)
+    OUTPUT_FILE.write_text(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Measure the normalise stage with every executor of the table construction and
+of the resource descriptions.
+
+Run it from the repository root with python -m benchmarks.normalise, the results
+are stored in reports/normalise_executors.json. Pick the fastest executors for
+TABLE_EXECUTOR and RESOURCE_EXECUTOR in parser/normalise.py.
+"""
+
+import json
+import sys
+import time
+from itertools import product
+from pathlib import Path
+
+from parser import normalise
+
+EXECUTORS = ["serial", "thread", "process"]
+REPEAT = 3
+OUTPUT_FILE = Path("reports/normalise_executors.json")
+
+
+def get_run_time(table_executor: str, resource_executor: str, filename=None):
+    """Return the fastest run time of the normalise stage in seconds."""
+    normalise.TABLE_EXECUTOR = table_executor
+    normalise.RESOURCE_EXECUTOR = resource_executor
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        normalise.get_normalised_data(filename)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    # The first run fills the cache of the clean stage
+    normalise.get_normalised_data(filename)
+
+    results = {}
+    for table_executor, resource_executor in product(EXECUTORS, EXECUTORS):
+        run_time = get_run_time(table_executor, resource_executor, filename)
+        results[f"{table_executor}/{resource_executor}"] = run_time
+        print(
+            f"tables {table_executor:8} resources {resource_executor:8} {run_time:8.2f} s"
+        )
+
+    OUTPUT_FILE.parent.mkdir(exist_ok=True, parents=True)
+    OUTPUT_FILE.write_text(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
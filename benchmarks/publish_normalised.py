@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Check the upload of the normalised tables against a local fake of the OEP API.
+
+The fake server records the order of the requests, the rows received per table
+and the number of requests in flight. The uploads run with fewer connections
+and smaller chunks than against the OEP, so the limit is reached. The check
+fails if a table is created before the uploads of the tables its foreign keys
+refer to are done, if the requests in flight exceed the limit or never reach it,
+or if rows are missing.
+
+Run it from the repository root with python -m benchmarks.publish_normalised,
+optionally with the path of a raw workbook. The results are stored in
+reports/publish_normalised.json.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from parser import publish_normalised
+from parser.rename import get_renamed_normalised
+
+# Time every request takes, so concurrent requests overlap
+DELAY = 0.02
+MAX_CONNECTIONS = 2
+CHUNK_SIZE = 100
+OUTPUT_FILE = Path("reports/publish_normalised.json")
+
+
+class FakeOEP:
+    """Record the requests of the uploads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.rows = {}
+        self.in_flight = 0
+        self.peak = 0
+
+    def get_handler(self):
+        oep = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self):
+                # /api/v0/schema/<topic>/tables/<table>/<action>
+                parts = self.path.strip("/").split("/")
+                table, action = parts[5], "/".join(parts[6:]) or "create"
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with oep.lock:
+                    oep.in_flight += 1
+                    oep.peak = max(oep.peak, oep.in_flight)
+                    oep.requests.append((table, action))
+                    if action == "rows/new":
+                        oep.rows[table] = oep.rows.get(table, 0) + len(body["query"])
+                time.sleep(DELAY)
+                with oep.lock:
+                    oep.in_flight -= 1
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            do_PUT = handle_request
+            do_POST = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def get_errors(oep: FakeOEP, data, filenames, metadata):
+    """Return the violations of the foreign key order, the limit and the rows."""
+    errors = []
+    names = publish_normalised.get_table_name
+    first = {}
+    last = {}
+    for position, (table, _) in enumerate(oep.requests):
+        first.setdefault(table, position)
+        last[table] = position
+    for resource in metadata["resources"]:
+        table = names(resource["name"])
+        for fk in resource["schema"].get("foreignKeys", []):
+            parent = names(fk["reference"]["resource"])
+            if parent == table or parent not in last:
+                continue
+            if first.get(table, -1) < last[parent]:
+                errors.append(f"{table} was uploaded before {parent} was done")
+    if oep.peak != MAX_CONNECTIONS:
+        errors.append(
+            f"At most {oep.peak} requests were in flight, the limit is {MAX_CONNECTIONS}"
+        )
+    keys = {filename: key for key, filename in filenames.items()}
+    for resource in metadata["resources"]:
+        table = names(resource["name"])
+        expected = len(data[keys[table]])
+        if oep.rows.get(table, 0) != expected:
+            errors.append(f"{table}: {oep.rows.get(table, 0)} of {expected} rows")
+    return errors
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    oep = FakeOEP()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), oep.get_handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    publish_normalised.OEP_URL = f"http://127.0.0.1:{server.server_port}"
+    publish_normalised.MAX_CONNECTIONS = MAX_CONNECTIONS
+    publish_normalised.CHUNK_SIZE = CHUNK_SIZE
+    os.environ.setdefault("OEP_API_TOKEN", "fake")
+    try:
+        start = time.perf_counter()
+        publish_normalised.main(filename)
+        run_time = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    data, filenames, metadata, _ = get_renamed_normalised(filename, oep=True)
+    errors = get_errors(oep, data, filenames, metadata)
+    results = {
+        "requests": len(oep.requests),
+        "peak_in_flight": oep.peak,
+        "max_connections": MAX_CONNECTIONS,
+        "run_time": run_time,
+        "errors": errors,
+    }
+    print(
+        f"{len(oep.requests)} requests, at most {oep.peak} in flight, {run_time:.2f} s"
+    )
+    OUTPUT_FILE.parent.mkdir(exist_ok=True, parents=True)
+    OUTPUT_FILE.write_text(json.dumps(results, indent=4))
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
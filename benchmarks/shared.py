@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Measure the hand-off of the cleaned frame to worker processes, pickled into
+every task or published once with parser/shared.py and attached by the workers.
+
+Run it from the repository root with python -m benchmarks.shared, the results
+are stored in reports/shared_handoff.json. The cleaned frame is repeated to
+ROWS rows, so the hand-off is measured at the size of a full snapshot.
+"""
+
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from parser.clean import get_clean_data
+from parser.shared import attach_frame, shared_frame
+
+ROWS = 150_000
+TASKS = 16
+MAX_WORKERS = 4
+REPEAT = 3
+OUTPUT_FILE = Path("reports/shared_handoff.json")
+
+
+def count_rows(df):
+    return int(df["Ladeeinrichtungs-ID"].count())
+
+
+def count_attached_rows(shared_path: str):
+    return count_rows(attach_frame(shared_path))
+
+
+def get_run_time(function, argument, executor):
+    """Return the fastest time of TASKS tasks of the workers in seconds."""
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        list(executor.map(function, [argument] * TASKS))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    df, _, _ = get_clean_data(filename)
+    df = pd.concat([df] * -(-ROWS // len(df)), ignore_index=True).iloc[:ROWS]
+
+    results = {"rows": len(df), "tasks": TASKS}
+    with ProcessPoolExecutor(MAX_WORKERS) as executor:
+        # The workers are started before the measurement
+        list(executor.map(count_rows, [df.iloc[:1]] * MAX_WORKERS))
+        results["pickle"] = get_run_time(count_rows, df, executor)
+
+        start = time.perf_counter()
+        with shared_frame(df) as shared_path:
+            results["publish"] = time.perf_counter() - start
+            results["attach"] = get_run_time(count_attached_rows, shared_path, executor)
+
+    for name in ["pickle", "publish", "attach"]:
+        print(f"{name:8} {results[name]:8.3f} s")
+    OUTPUT_FILE.parent.mkdir(exist_ok=True, parents=True)
+    OUTPUT_FILE.write_text(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
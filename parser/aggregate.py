@@ -0,0 +1,229 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+from .normalise import get_normalised_data
+from .dates import MONTH_FORMAT, format_dates
+from .output import write_csv, write_json
+from .subset import get_output_dir
+from os import path
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+CUBEDIR = "cube"
+CUBE_FILENAME = "bnetza_cube_{name}.csv"
+FACT_FILENAME = "bnetza_facts_{name}.csv"
+SNAPSHOT_FILENAME = "snapshot.json"
+
+# Rows changed between snapshots, relative to the facts, below which the cube is updated instead of recomputed
+INCREMENTAL_THRESHOLD = 0.1
+
+MEASURES = ["columns", "points", "capacity"]
+COUNTS = ["columns", "points"]
+FACT_DIMENSIONS = {
+    "columns": [
+        "Bundesland",
+        "Kreis/kreisfreie Stadt",
+        "Betreiber",
+        "Inbetriebnahmemonat",
+    ],
+    "connectors": ["connector"],
+}
+CUBE_DIMENSIONS = {
+    "federal_state": ("columns", ["Bundesland"]),
+    "county": ("columns", ["Bundesland", "Kreis/kreisfreie Stadt"]),
+    "operator": ("columns", ["Betreiber"]),
+    "month": ("columns", ["Inbetriebnahmemonat"]),
+    "connector": ("connectors", ["connector"]),
+}
+
+
+def get_facts(data):
+    """
+    Reduce the normalised tables to the fact tables the cube is built from.
+
+    The column facts hold one row per charging column, the connector facts
+    one row per column and connector type with the points supporting it.
+    """
+    column = data["column"]
+    location = (
+        data["geolocation"][["address_id"]]
+        .join(
+            data["address"][["Bundesland", "Kreis/kreisfreie Stadt"]], on="address_id"
+        )
+        .drop(columns="address_id")
+    )
+    operator = data["facility"][["operator_id"]].join(
+        data["operator"], on="operator_id"
+    )
+    column_facts = (
+        column[["geolocation_id", "facility_id"]]
+        .join(location, on="geolocation_id")
+        .join(operator[["Betreiber"]], on="facility_id")
+        .drop(columns=["geolocation_id", "facility_id"])
+    )
+    column_facts["Inbetriebnahmemonat"] = format_dates(
+        column["Inbetriebnahmedatum"], MONTH_FORMAT
+    )
+    column_facts["columns"] = 1
+    column_facts["points"] = column["Anzahl Ladepunkte"]
+    column_facts["capacity"] = column["Nennleistung Ladeeinrichtung [kW]"]
+
+    socket = data["socket"]
+    connector = socket[["current", "pattern", "connector"]].apply(
+        lambda x: "_".join(x.dropna()), axis=1
+    )
+    points = (
+        data["compatibility"]
+        .join(data["point"][["column_id"]], on="point_id")
+        .assign(
+            connector=lambda x: x["socket_id"].map(connector),
+            power=lambda x: pd.to_numeric(
+                x["socket_id"].map(socket["power"]), errors="coerce"
+            ),
+        )
+    )
+    # A point offering several power levels of one connector is counted once with its highest power
+    points = points.groupby(["column_id", "point_id", "connector"], as_index=False)[
+        "power"
+    ].max()
+    connector_facts = points.groupby(["column_id", "connector"]).agg(
+        points=("point_id", "count"), capacity=("power", "sum")
+    )
+    connector_facts.insert(0, "columns", 1)
+    connector_facts = connector_facts.reset_index(level="connector")
+    connector_facts.index.name = "id"
+
+    facts = {"columns": column_facts, "connectors": connector_facts}
+    for name, dimensions in FACT_DIMENSIONS.items():
+        facts[name] = facts[name][dimensions + MEASURES].reset_index()
+        facts[name][dimensions] = facts[name][dimensions].fillna("").astype(str)
+        facts[name][MEASURES] = facts[name][MEASURES].fillna(0).astype(float)
+    return facts
+
+
+def get_fact_delta(old, new):
+    """
+    Return the fact rows that changed between two snapshots.
+
+    Removed rows carry negated measures, so the delta can be added to aggregates of the old facts.
+    """
+    merged = old.merge(new, how="outer", indicator=True)
+    delta = merged[merged["_merge"] != "both"].copy()
+    removed = delta["_merge"] == "left_only"
+    delta.loc[removed, MEASURES] = -delta.loc[removed, MEASURES]
+    return delta.drop(columns="_merge")
+
+
+def aggregate(facts, dimensions):
+    """Sum the measures of the facts along the dimensions."""
+    return facts.groupby(dimensions)[MEASURES].sum()
+
+
+def update_aggregate(cube, delta, dimensions):
+    """Add a fact delta to an aggregate and drop the groups that became empty."""
+    cube = cube.add(aggregate(delta, dimensions), fill_value=0)
+    return cube[cube["columns"] != 0]
+
+
+def add_cumulative(cube):
+    """Add the capacity and columns commissioned up to each month."""
+    cube = cube.sort_index()
+    cube["cumulative_columns"] = cube["columns"].cumsum()
+    cube["cumulative_capacity"] = cube["capacity"].cumsum()
+    return cube
+
+
+def get_cube_dir(cube_dir: str | None = None):
+    """Return the cube directory, the one of the subset in subset mode by default."""
+    return get_output_dir(CUBEDIR) if cube_dir is None else cube_dir
+
+
+def read_facts(name, cube_dir: str | None = None):
+    """Read a fact table stored with the previous cube."""
+    cube_dir = get_cube_dir(cube_dir)
+    dimensions = FACT_DIMENSIONS[name]
+    return pd.read_csv(
+        path.join(cube_dir, FACT_FILENAME.format(name=name)),
+        dtype={d: str for d in dimensions},
+        keep_default_na=False,
+        float_precision="round_trip",
+        encoding="utf-8",
+    ).astype({m: float for m in MEASURES})
+
+
+def read_cube(name, cube_dir: str | None = None):
+    """Read an aggregate of the previous cube."""
+    cube_dir = get_cube_dir(cube_dir)
+    dimensions = CUBE_DIMENSIONS[name][1]
+    cube = pd.read_csv(
+        path.join(cube_dir, CUBE_FILENAME.format(name=name)),
+        dtype={d: str for d in dimensions},
+        keep_default_na=False,
+        float_precision="round_trip",
+        encoding="utf-8",
+    )
+    return cube.set_index(dimensions)[MEASURES].astype(float)
+
+
+def get_cube(
+    filename: str | None = None,
+    download_date: tuple | None = None,
+    cube_dir: str | None = None,
+):
+    cube_dir = get_cube_dir(cube_dir)
+    data, _, _, (dd, mm, yyyy) = get_normalised_data(filename, download_date)
+    facts = get_facts(data)
+
+    previous = all(
+        path.exists(path.join(cube_dir, FACT_FILENAME.format(name=name)))
+        for name in FACT_DIMENSIONS
+    ) and all(
+        path.exists(path.join(cube_dir, CUBE_FILENAME.format(name=name)))
+        for name in CUBE_DIMENSIONS
+    )
+    deltas = {}
+    if previous:
+        deltas = {
+            name: get_fact_delta(read_facts(name, cube_dir), facts[name])
+            for name in facts
+        }
+        changed = sum(len(d) for d in deltas.values())
+        if changed > INCREMENTAL_THRESHOLD * sum(len(f) for f in facts.values()):
+            deltas = {}
+
+    cube = {}
+    for name, (fact_name, dimensions) in CUBE_DIMENSIONS.items():
+        if deltas:
+            cube[name] = update_aggregate(
+                read_cube(name, cube_dir), deltas[fact_name], dimensions
+            )
+        else:
+            cube[name] = aggregate(facts[fact_name], dimensions)
+        cube[name] = cube[name].round(6).sort_index()
+        cube[name][COUNTS] = cube[name][COUNTS].astype(int)
+    cube["month"] = add_cumulative(cube["month"])
+
+    print(
+        f"Cube {'updated' if deltas else 'recomputed'} for the snapshot {dd}.{mm}.{yyyy}."
+    )
+    return cube, facts, (dd, mm, yyyy)
+
+
+def main():
+    cube_dir = get_cube_dir()
+    cube, facts, (dd, mm, yyyy) = get_cube(cube_dir=cube_dir)
+
+    for name, table in cube.items():
+        write_csv(table, f"{cube_dir}/{CUBE_FILENAME.format(name=name)}")
+    for name, table in facts.items():
+        write_csv(table, f"{cube_dir}/{FACT_FILENAME.format(name=name)}", index=False)
+    write_json(
+        {"publicationDate": f"{yyyy}-{mm}-{dd}"},
+        f"{cube_dir}/{SNAPSHOT_FILENAME}",
+        indent=4,
+    )
+
+
+if __name__ == "__main__":
+    main()
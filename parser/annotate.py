@@ -2,17 +2,27 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from .clean import get_clean_data, FAIRDIR
-import frictionless as fl
-import yaml
+from .keys import KEY_FILENAME, get_key_resource
 from collections import OrderedDict
-import json
+from functools import cache
+from .output import write_json
+from .subset import describe_subset, get_output_dir
 from os import mkdir, path
+from .lazy import lazy_import
 
-INPUT_METADATA_FILE = "metadata.yaml"
-if not path.exists(INPUT_METADATA_FILE):
-    INPUT_METADATA_FILE = "../metadata.yaml"
-if not path.exists(INPUT_METADATA_FILE):
-    INPUT_METADATA_FILE = "bnetza/metadata.yaml"
+fl = lazy_import("frictionless")
+yaml = lazy_import("yaml")
+
+INPUT_METADATA_FILES = ["metadata.yaml", "../metadata.yaml", "bnetza/metadata.yaml"]
+
+
+@cache
+def get_metadata_file():
+    """Return the first metadata file found, the lookup only runs once."""
+    for metadata_file in INPUT_METADATA_FILES:
+        if path.exists(metadata_file):
+            return metadata_file
+    return INPUT_METADATA_FILES[-1]
 
 
 def annotate(filename: str | None = None, download_date: tuple | None = None):
@@ -24,11 +34,11 @@ def annotate(filename: str | None = None, download_date: tuple | None = None):
     )  # If you want a specific date write the it in the forma (dd, mm, yyyy) ex: (1,2,2023)
 
     # get current file schema
-    schema = fl.Schema.describe(f"{FAIRDIR}/{filename}.csv")
+    schema = fl.Schema.describe(f"{get_output_dir(FAIRDIR)}/{filename}.csv")
     dictionary = schema.to_dict()
 
     # get annotated fields
-    with open(INPUT_METADATA_FILE, "r", encoding="utf-8") as f:
+    with open(get_metadata_file(), "r", encoding="utf-8") as f:
         annotations = yaml.safe_load(f)
 
     # assert field similarity
@@ -54,6 +64,13 @@ def annotate(filename: str | None = None, download_date: tuple | None = None):
     annotations["resources"][0]["format"] = "csv"
     annotations["resources"][0]["encoding"] = "utf-8"
     annotations["resources"][0]["schema"]["fields"] = values
+    key_filename = KEY_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)
+    annotations["resources"] = [
+        annotations["resources"][0],
+        get_key_resource(key_filename, f"{key_filename}.csv"),
+    ]
+
+    annotations["description"] = annotations.get("description", "") + describe_subset()
 
     # Update name
     annotations["name"] = annotations["name"] + f"_{dd}_{mm}_{yyyy}"
@@ -66,8 +83,12 @@ def annotate(filename: str | None = None, download_date: tuple | None = None):
 def main():
     _, filename, annotations, (_, _, _) = annotate()
 
-    with open(f"{FAIRDIR}/{filename}.json", "w", encoding="utf8") as output:
-        json.dump(annotations, output, indent=4, ensure_ascii=False)
+    write_json(
+        annotations,
+        f"{get_output_dir(FAIRDIR)}/{filename}.json",
+        indent=4,
+        ensure_ascii=False,
+    )
 
 
 if __name__ == "__main__":
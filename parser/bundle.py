@@ -0,0 +1,238 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Package the normalised bundle and the default dataset into a release archive.
+
+Every file is compressed as its own gzip member of a tar.gz archive. A sequence
+of gzip members is a valid gzip stream, so the archive unpacks with any tar, while
+the members are compressed in parallel and written in order as they are done.
+At most MAX_WORKERS members are in flight and every one of them holds at most
+BUFFERED_CHUNKS compressed chunks in memory until it is written, so the memory
+used does not grow with the size of the bundle and nothing is copied to disk.
+"""
+
+import hashlib
+import os
+import queue
+import re
+import tarfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .output import MANIFEST_FILENAME, write_json
+from .rename import BUNDLE_DIRNAME, DEFAULT_DIR, get_latest_bundle
+from .subset import get_output_dir
+
+RELEASEDIR = "release"
+ARCHIVE_FILENAME = "{name}.tar.gz"
+REPORTDIR = "reports"
+REPORT_FILENAME = "bundle_{name}.json"
+
+COMPRESSION_LEVEL = 6
+# zlib releases the GIL while compressing, so threads compress in parallel
+MAX_WORKERS = os.cpu_count()
+# Size of the chunks the files are read and compressed in
+CHUNK_SIZE = 1 << 22
+# Compressed chunks a member in flight holds until the archive takes them
+BUFFERED_CHUNKS = 4
+# Seconds a worker waits for room in its buffer before checking for an abort
+POLL_INTERVAL = 0.1
+
+
+def get_members(directories, suffix: str = ""):
+    """
+    Return (path, name in the archive) of the files in the directories whose
+    names without extension end with suffix.
+    """
+    members = []
+    for directory in directories:
+        directory = Path(directory)
+        for file_path in sorted(directory.iterdir()):
+            # The manifests of the directories are replaced by one for the archive
+            if not file_path.is_file() or file_path.name == MANIFEST_FILENAME:
+                continue
+            if file_path.name.startswith(".") or not file_path.stem.endswith(suffix):
+                continue
+            members.append((file_path, f"{directory.name}/{file_path.name}"))
+    return members
+
+
+def get_header(name: str, size: int, mtime: float):
+    """Return the tar header of a file."""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def put_chunk(chunks, data, abort):
+    """Put a chunk into the buffer of a member, give up once the archive is aborted."""
+    while not abort.is_set():
+        try:
+            chunks.put(data, timeout=POLL_INTERVAL)
+            return
+        except queue.Full:
+            pass
+    raise RuntimeError("The archive was aborted")
+
+
+def compress_member(file_path, name: str, chunks, abort):
+    """
+    Compress the tar entry of a file into a gzip member put into chunks in pieces.
+
+    The member ends with None, also after an error. Returns the statistics of
+    the member, the SHA256 of the file is computed on the way.
+    """
+    start = time.perf_counter()
+    compressed_size = 0
+
+    def put(data: bytes):
+        nonlocal compressed_size
+        if data:
+            compressed_size += len(data)
+            put_chunk(chunks, data, abort)
+
+    try:
+        stat = file_path.stat()
+        # wbits 31 writes a gzip header and trailer
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        digest = hashlib.sha256()
+        put(compressor.compress(get_header(name, stat.st_size, stat.st_mtime)))
+        with open(file_path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+                put(compressor.compress(chunk))
+        put(compressor.compress(b"\0" * (-stat.st_size % tarfile.BLOCKSIZE)))
+        put(compressor.flush())
+    finally:
+        put_chunk(chunks, None, abort)
+    return {
+        "name": name,
+        "size": stat.st_size,
+        "compressed_size": compressed_size,
+        "ratio": round(compressed_size / max(stat.st_size, 1), 4),
+        "seconds": round(time.perf_counter() - start, 4),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def write_oldest(pending, archive, archive_hash):
+    """
+    Write the chunks of the oldest member in flight into the archive as they are
+    compressed, returns its statistics.
+    """
+    chunks, future = pending.popleft()
+    while (chunk := chunks.get()) is not None:
+        archive.write(chunk)
+        archive_hash.update(chunk)
+    return future.result()
+
+
+def gzip_bytes(*parts: bytes):
+    """Compress the parts into a single gzip member."""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    return b"".join(compressor.compress(p) for p in parts) + compressor.flush()
+
+
+def get_manifest_member(report):
+    """Return the gzip member of the checksum manifest of the archive."""
+    manifest = "".join(f"{m['sha256']}  {m['name']}\n" for m in report).encode()
+    return gzip_bytes(
+        get_header(MANIFEST_FILENAME, len(manifest), time.time()),
+        manifest,
+        b"\0" * (-len(manifest) % tarfile.BLOCKSIZE),
+    )
+
+
+def write_archive(directories, archive_path, suffix: str = ""):
+    """
+    Write a tar.gz archive of the directories with a checksum manifest, only
+    files whose names without extension end with suffix are included.
+
+    Returns the statistics of every member.
+    """
+    members = get_members(directories, suffix)
+    archive_path = Path(archive_path)
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    archive_hash = hashlib.sha256()
+    report = []
+    # Buffers and results of the members in flight, in archive order
+    pending = deque()
+    # Stops the workers when the archive cannot be written
+    abort = threading.Event()
+    with (
+        open(archive_path, "wb") as archive,
+        ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool,
+    ):
+        try:
+            for member in members:
+                chunks = queue.Queue(maxsize=BUFFERED_CHUNKS)
+                pending.append(
+                    (chunks, pool.submit(compress_member, *member, chunks, abort))
+                )
+                # The oldest member is written before another one is started
+                if len(pending) >= MAX_WORKERS:
+                    report.append(write_oldest(pending, archive, archive_hash))
+            while pending:
+                report.append(write_oldest(pending, archive, archive_hash))
+        except BaseException:
+            abort.set()
+            raise
+
+        for data in [
+            get_manifest_member(report),
+            # Two zero blocks padded to a full record end the archive
+            gzip_bytes(b"\0" * tarfile.RECORDSIZE),
+        ]:
+            archive.write(data)
+            archive_hash.update(data)
+
+    # Checksum of the archive itself, in the format of sha256sum
+    archive_path.with_name(f"{archive_path.name}.sha256").write_text(
+        f"{archive_hash.hexdigest()}  {archive_path.name}\n", encoding="utf-8"
+    )
+    return report
+
+
+def main():
+    bundle = get_latest_bundle()
+    yyyy, mm, dd = re.fullmatch(
+        BUNDLE_DIRNAME.format(yyyy=r"(\d{4})", mm=r"(\d{2})", dd=r"(\d{2})"),
+        bundle.name,
+    ).groups()
+    archive_path = Path(get_output_dir(RELEASEDIR)).joinpath(
+        ARCHIVE_FILENAME.format(name=bundle.name)
+    )
+
+    start = time.perf_counter()
+    # The default directory holds the files of every snapshot, only the ones of
+    # the bundle are released with it
+    report = write_archive(
+        [bundle, get_output_dir(DEFAULT_DIR)], archive_path, f"_{dd}_{mm}_{yyyy}"
+    )
+    total = time.perf_counter() - start
+
+    for m in report:
+        print(
+            f"{m['name']:70} {m['size'] / 1e6:8.1f} MB {m['ratio']:6.1%} {m['seconds']:6.2f} s"
+        )
+    print(f"{archive_path} written in {total:.2f} s")
+
+    write_json(
+        {
+            "archive": str(archive_path),
+            "seconds": round(total, 4),
+            "members": report,
+        },
+        Path(get_output_dir(REPORTDIR)).joinpath(REPORT_FILENAME.format(name=bundle.name)),
+        indent=4,
+    )
+
+
+if __name__ == "__main__":
+    main()
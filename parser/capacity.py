@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Reconcile the declared capacity of the charging columns with their plug powers.
+
+The plug powers of all points are parsed in one pass, every distinct power list
+once. A point delivers the maximum power of its sockets, so a column delivers at
+most the sum of the powers of its points. The declared capacity and number of
+points are compared with the ones of the points and the inconsistencies are
+flagged.
+"""
+
+from .clean import CAPACITY, POINTS, get_clean_data, get_counted_points
+from .output import write_csv
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+REPORTDIR = "reports"
+REPORT_FILENAME = "capacity_{dd}_{mm}_{yyyy}.csv"
+
+ID = "Ladeeinrichtungs-ID"
+POWER_COLUMNS = [f"Nennleistung Stecker{n}" for n in range(1, 7)]
+# Capacities within this relative difference are consistent, they are rounded
+RELATIVE_TOLERANCE = 0.01
+# Powers meaning no power, in lower case. The cleaning writes "NaN" for blank
+# powers, which only read back as missing from the cached CSV
+MISSING_POWERS = ["", "nan", "<na>"]
+ISSUES = [
+    "points_mismatch",
+    "declared_above_sum",
+    "declared_below_max",
+    "missing_capacity",
+    "missing_plug_power",
+    "unparsable_plug_power",
+]
+
+
+def parse_powers(values):
+    """
+    Parse power lists like "11;3,7" into the power of the point and whether a
+    power could not be parsed, every distinct list is parsed once. Empty and
+    "NaN" powers are missing, not unparsable.
+    """
+    codes, uniques = pd.factorize(values)
+    parts = (
+        pd.Series(uniques, dtype="string")
+        .str.replace(",", ".")
+        .str.split(";")
+        .explode()
+        .str.strip()
+    )
+    parts = parts[~parts.str.lower().isin(MISSING_POWERS)]
+    numbers = pd.to_numeric(parts, errors="coerce")
+    power = numbers.groupby(level=0).max().reindex(range(len(uniques)))
+    unparsable = (
+        numbers.isna()
+        .groupby(level=0)
+        .any()
+        .reindex(range(len(uniques)), fill_value=False)
+    )
+    # The last value is taken by the missing values, coded as -1
+    power = np.append(power.to_numpy(dtype=float), np.nan)
+    unparsable = np.append(unparsable.to_numpy(dtype=bool), False)
+    return power[codes], unparsable[codes]
+
+
+def get_capacity_reconciliation(df):
+    """
+    Return the declared, summed and maximum power in kW and the declared, counted
+    and powered points of every column with a flag for every issue.
+
+    df has to hold the declared number of points, see keep_declared_points of
+    get_clean_data.
+    """
+    rows, points = len(df), len(POWER_COLUMNS)
+    # The powers of all points are parsed at once, row by row
+    values = pd.Series(df[POWER_COLUMNS].to_numpy(dtype=object).ravel())
+    values = values.where(values.notna(), None)
+    power, unparsable = parse_powers(values)
+    power = pd.DataFrame(power.reshape(rows, points), index=df.index)
+
+    table = pd.DataFrame(
+        {
+            ID: df[ID],
+            "Betreiber": df["Betreiber"],
+            "declared_kw": pd.to_numeric(df[CAPACITY], errors="coerce"),
+            "summed_kw": power.sum(axis=1, min_count=1),
+            "max_kw": power.max(axis=1),
+            "declared_points": df[POINTS],
+            "counted_points": get_counted_points(df),
+            "powered_points": power.notna().sum(axis=1),
+        }
+    )
+    tolerance = 1 + RELATIVE_TOLERANCE
+    table["points_mismatch"] = table["declared_points"].ne(table["counted_points"])
+    table["declared_above_sum"] = table["declared_kw"] > table["summed_kw"] * tolerance
+    table["declared_below_max"] = table["declared_kw"] * tolerance < table["max_kw"]
+    table["missing_capacity"] = table["declared_kw"].isna()
+    table["missing_plug_power"] = table["powered_points"] < table["counted_points"]
+    table["unparsable_plug_power"] = unparsable.reshape(rows, points).any(axis=1)
+    return table
+
+
+def main():
+    # The declared number of points is compared, not the counted one
+    df, _, (dd, mm, yyyy) = get_clean_data(keep_declared_points=True)
+    table = get_capacity_reconciliation(df)
+    flagged = table[table[ISSUES].any(axis=1)]
+    write_csv(
+        flagged,
+        f"{get_output_dir(REPORTDIR)}/{REPORT_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}",
+        index=False,
+    )
+    print(f"{len(flagged)} of {len(table)} columns are inconsistent")
+    for issue, count in table[ISSUES].sum().items():
+        print(f"{count:8} {issue}")
+
+
+if __name__ == "__main__":
+    main()
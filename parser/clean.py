@@ -1,34 +1,127 @@
 # SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
 # SPDX-License-Identifier: BSD-3-Clause
 
-from .load import get_raw
-import pandas as pd
+from .load import HEADER_ROW, get_raw, probe_workbook
+from .keys import KEY_FILENAME, KEY_ID_COLUMNS, externalise_keys, read_keys
+from .output import write_csv
+from .dates import DATE_COLUMNS, DATETIME_FORMAT, parse_dates
+from . import subset
+from .subset import apply_subset, get_output_dir
+from datetime import datetime
+from numbers import Number
 from os import path, mkdir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 
 INPUT_METADATA_FILE = "metadata.yaml"
 
 FAIRDIR = "fair"
+REPORTDIR = "reports"
+DUPLICATE_FILENAME = "duplicates_{dd}_{mm}_{yyyy}.csv"
+
+FINGERPRINT = "Fingerabdruck"
+CAPACITY = "Nennleistung Ladeeinrichtung [kW]"
+POINTS = "Anzahl Ladepunkte"
+PLUG_TYPE_COLUMNS = [f"Steckertypen{n}" for n in range(1, 7)]
+# Keep the declared number of charging points instead of counting the points
+KEEP_DECLARED_POINTS = False
+
+
+def get_canonical_text(value):
+    """
+    Return the text of a cell independent of the type of its column.
+
+    Numbers are written as floats, so 11, 11.0 and 11.0 in a column of text are
+    the same, dates in ISO format.
+    """
+    if isinstance(value, (bool, np.bool_)) or not isinstance(value, Number):
+        if isinstance(value, (datetime, np.datetime64)):
+            return pd.Timestamp(value).isoformat()
+        return str(value)
+    return repr(float(value))
+
+
+def get_fingerprints(df):
+    """
+    Return a 64 bit fingerprint of the content of every row.
+
+    The types pandas infers for a column depend on all its values, so the cells
+    are hashed in their canonical text and a row keeps its fingerprint across
+    snapshots. Every distinct value of a column is converted once.
+    """
+    texts = {}
+    for column in df.columns:
+        codes, uniques = pd.factorize(df[column])
+        # The last value is taken by the missing values, coded as -1
+        text = np.array([get_canonical_text(v) for v in uniques] + [""], dtype=object)
+        texts[column] = text[codes]
+    fingerprints = pd.util.hash_pandas_object(
+        pd.DataFrame(texts, index=df.index), index=False
+    )
+    # Signed, so the fingerprints survive a round trip through CSV as int64
+    return fingerprints.to_numpy().view("int64")
+
+
+def get_duplicate_audit(duplicates):
+    """Return the number and capacity in kW of the duplicates per operator and state."""
+    capacity = pd.to_numeric(
+        duplicates[CAPACITY].astype("string").str.replace(",", "."), errors="coerce"
+    )
+    return (
+        duplicates.assign(capacity=capacity)
+        .groupby(["Betreiber", "Bundesland"], dropna=False)
+        .agg(dropped=(FINGERPRINT, "size"), capacity=("capacity", "sum"))
+        .reset_index()
+        .rename(columns={"capacity": "capacity_kw"})
+        .sort_values(["dropped", "capacity_kw"], ascending=False)
+    )
+
+
+def get_counted_points(df):
+    """Return the number of charging points with plug types of every column."""
+    return df[PLUG_TYPE_COLUMNS].notna().sum(axis=1)
+
 
+def get_clean_data(
+    filename: str | None = None,
+    download_date: tuple | None = None,
+    keep_declared_points: bool | None = None,
+):
+    """
+    Return the cleaned data, the name of the snapshot and its date.
 
-def get_clean_data(filename: str | None = None, download_date: tuple | None = None):
+    The declared number of charging points is replaced by the number of points
+    with plug types, unless keep_declared_points, by default KEEP_DECLARED_POINTS,
+    is set.
+    """
+    if keep_declared_points is None:
+        keep_declared_points = KEEP_DECLARED_POINTS
     if not path.exists(FAIRDIR):
         mkdir(FAIRDIR)
 
     if filename is None:
         filename = get_raw(download_date)
 
-    excel = pd.ExcelFile(filename)
-
-    # Get current stand information
-    dd, mm, yyyy = pd.read_excel(excel, nrows=10).iloc[6, 0].split(" ")[-1].split(".")
+    raw_filename = filename
+    # Get current stand information, without parsing or hashing the whole workbook
+    dd, mm, yyyy = probe_workbook(raw_filename, file_hash=False)["date"]
     filename = f"bnetza_charging_stations_{dd}_{mm}_{yyyy}"
 
     # Export as clean csv
-
-    if not path.exists(f"{FAIRDIR}/{filename}.csv"):
-        df = pd.read_excel(excel, header=10)
-        # to measure duplicated capacity: df[df.duplicated()]["Nennleistung Ladeeinrichtung [kW]"].sum()
-        df = df.drop_duplicates(ignore_index=True)
+    key_path = f"{FAIRDIR}/{KEY_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}.csv"
+    if not path.exists(f"{FAIRDIR}/{filename}.csv") or not path.exists(key_path):
+        df = pd.read_excel(raw_filename, header=HEADER_ROW - 1)
+        # Identical rows have the same fingerprint, it is kept to compare rows later
+        df[FINGERPRINT] = get_fingerprints(df)
+        duplicated = df[FINGERPRINT].duplicated()
+        write_csv(
+            get_duplicate_audit(df[duplicated]),
+            f"{REPORTDIR}/{DUPLICATE_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}",
+            index=False,
+        )
+        df = df[~duplicated].reset_index(drop=True)
 
         # cleaning mixed types in column, looks clunky but dom't know a more transparent way, the data is just too heterogeneous.
         # Some column have string numbers, some use commas to separate decimals and some use points.
@@ -53,43 +146,81 @@ def get_clean_data(filename: str | None = None, download_date: tuple | None = No
         # The version from 16.07.2024 has a format issue in one entry that breaks this part of the script
         # because of this we strip
         df["Breitengrad"] = (
-            df["Breitengrad"].astype("string").str.replace(",", ".").str.strip(".")
+            df["Breitengrad"]
+            .astype("string")
+            .str.replace(",", ".")
+            .str.strip(".")
+            .astype(float)
         )
         df["Längengrad"] = (
             df["Längengrad"].astype("string").str.replace(",", ".").astype(float)
         )
         # Replace cleaning steps when the source is changed
         # Drop all duplicates
-        df["Inbetriebnahmedatum"] = pd.to_datetime(df["Inbetriebnahmedatum"])
-        df.to_csv(
+        for column in DATE_COLUMNS:
+            df[column] = parse_dates(df[column])
+        # The public keys are long and repeated, they are stored once in a key table
+        df, keys = externalise_keys(df)
+        write_clean_data(df, keys, FAIRDIR, filename, key_path)
+    else:
+        df = pd.read_csv(
             f"{FAIRDIR}/{filename}.csv",
-            sep=",",
             decimal=".",
+            sep=",",
             encoding="utf-8",
-            date_format="%Y-%m-%d %H:%M:%S",
-            index=False,
+            dtype={FINGERPRINT: "int64", **{c: "Int64" for c in KEY_ID_COLUMNS}},
+            parse_dates=DATE_COLUMNS,
+            date_format=DATETIME_FORMAT,
+            memory_map=True,
         )
-    else:
-        df = pd.read_csv(
-            f"{FAIRDIR}/{filename}.csv", decimal=".", sep=",", encoding="utf-8"
+
+    # The later stages only see the subset, it is written for annotate
+    if subset.SUBSET is not None:
+        df = apply_subset(df)
+        keys = read_keys(key_path)
+        keys = keys[keys.index.isin(df[KEY_ID_COLUMNS].stack())]
+        write_clean_data(
+            df, keys, get_output_dir(FAIRDIR), filename, get_key_path(dd, mm, yyyy)
         )
-    # Datetime format
-    df["Inbetriebnahmedatum"] = pd.to_datetime(df["Inbetriebnahmedatum"])
-
-    # There is an incongruency between charging points declared and the ones given in the point list
-    # TODO: Is it reasonable to replace the declared number with the actual values?
-    # df["counted"] = (~ df["Steckertypen1"].isna()).astype(int) + (~ df["Steckertypen2"].isna()).astype(int) + (~ df["Steckertypen3"].isna()).astype(int) + (~ df["Steckertypen4"].isna()).astype(int)
-    df["Anzahl Ladepunkte"] = (
-        (~df["Steckertypen1"].isna()).astype(int)
-        + (~df["Steckertypen2"].isna()).astype(int)
-        + (~df["Steckertypen3"].isna()).astype(int)
-        + (~df["Steckertypen4"].isna()).astype(int)
-        + (~df["Steckertypen5"].isna()).astype(int)
-        + (~df["Steckertypen6"].isna()).astype(int)
-    )
+
+    # There is an incongruency between charging points declared and the ones given
+    # in the point list, parser/capacity.py reports them
+    if not keep_declared_points:
+        df[POINTS] = get_counted_points(df)
     return df, filename, (dd, mm, yyyy)
 
 
+def write_clean_data(df, keys, directory: str, filename: str, key_path: str):
+    """Write the cleaned data and its key table."""
+    write_csv(keys, key_path, encoding="utf-8")
+    write_csv(
+        df,
+        f"{directory}/{filename}.csv",
+        sep=",",
+        decimal=".",
+        encoding="utf-8",
+        date_format=DATETIME_FORMAT,
+        index=False,
+    )
+
+
+def get_key_path(dd: str, mm: str, yyyy: str):
+    """Return the path of the key table, the one of the subset in subset mode."""
+    return (
+        f"{get_output_dir(FAIRDIR)}/{KEY_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}.csv"
+    )
+
+
+def get_public_keys(dd: str, mm: str, yyyy: str):
+    """
+    Load the public key table of a cleaned snapshot.
+
+    The cleaned data only holds references to the keys, so stages that do not
+    need the keys never read them.
+    """
+    return read_keys(get_key_path(dd, mm, yyyy))
+
+
 def main():
     get_clean_data()  # If you want a specific date write the it in the forma (dd, mm, yyyy) ex: (1,2,2023)
 
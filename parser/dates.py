@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Parse and format the dates of the dataset.
+
+Dates are parsed once, when the source or a cache is read, and stay typed
+datetime columns in every stage. They are only turned into strings when they are
+written, every distinct date is formatted once.
+"""
+
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+DATE_COLUMNS = ["Inbetriebnahmedatum"]
+# Format of the dates in the written files
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+MONTH_FORMAT = "%Y-%m"
+# Formats the source used for dates stored as text, tried in order
+SOURCE_DATE_FORMATS = [DATETIME_FORMAT, DATE_FORMAT, "%d.%m.%Y"]
+
+
+def parse_dates(values, formats: list = SOURCE_DATE_FORMATS):
+    """
+    Parse a column of dates with explicit formats.
+
+    Columns that are already datetime are returned as they are. Values matching
+    none of the formats are missing.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    codes, uniques = pd.factorize(values.astype("string"))
+    parsed = pd.Series(pd.NaT, index=range(len(uniques)), dtype="datetime64[ns]")
+    for date_format in formats:
+        missing = parsed.isna().to_numpy()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(
+            uniques[missing], format=date_format, errors="coerce"
+        )
+    # The last value is taken by the missing values, coded as -1
+    parsed = np.append(parsed.to_numpy(), np.datetime64("NaT", "ns"))
+    return pd.Series(parsed[codes], index=values.index, name=values.name)
+
+
+def format_dates(values, date_format: str = DATETIME_FORMAT):
+    """Format a column of dates as strings, missing dates stay missing."""
+    codes, uniques = pd.factorize(parse_dates(values))
+    formatted = np.append(uniques.strftime(date_format).to_numpy(dtype=object), None)
+    return pd.Series(formatted[codes], index=values.index, name=values.name)
+
+
+def format_date_columns(df, date_format: str = DATETIME_FORMAT):
+    """Return the frame with its datetime columns formatted, without copying the others."""
+    columns = [
+        c
+        for c, dtype in df.dtypes.items()
+        if pd.api.types.is_datetime64_any_dtype(dtype)
+    ]
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for column in columns:
+        df[column] = format_dates(df[column], date_format)
+    return df
@@ -1,19 +1,22 @@
 # SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
 # SPDX-License-Identifier: BSD-3-Clause
 
-import requests
 import json
-import jsonschema_rs
 from pathlib import Path
 from .clean import get_clean_data, FAIRDIR
 from .normalise import NORMALIZED_FILENAME, NORMALISEDIR
 from .rename import (
     OEP_REGULAR_FILEANAME,
     OEP_NORMAL_FILENAME,
-    OEPDIR_DEFAULT,
-    OEPDIR_NORMAL,
+    DEFAULT_DIR,
+    BUNDLE_DIR,
+    BUNDLE_DIRNAME,
 )
-from os import path, mkdir
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+requests = lazy_import("requests")
+jsonschema_rs = lazy_import("jsonschema_rs")
 
 METADATA_GENERIC = "https://raw.githubusercontent.com/OpenEnergyPlatform/oemetadata/develop/metadata/{}/schema.json"
 
@@ -50,6 +53,14 @@ def get_metadata(source):
     return package
 
 
+def write_report(report, name, version):
+    report_dir = get_output_dir("reports")
+    output_file = Path(f"{report_dir}/report_{name}_{version}.json")
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+    with open(output_file, "w") as fp:
+        json.dump(report, fp, indent=4, sort_keys=False)
+
+
 def test_compilance(metadata_path, version):
     metadata_object = get_metadata(metadata_path)
     metadata = load_metadata(version)
@@ -64,14 +75,7 @@ def test_compilance(metadata_path, version):
                 "instance_path": error.instance_path,
             }
             report.append(error_dict)
-        name = Path(metadata_path).stem
-
-        if not path.exists(f"reports"):
-            mkdir(f"reports")
-        output_file = Path(f"reports/report_{name}_{version}.json")
-        output_file.parent.mkdir(exist_ok=True, parents=True)
-        with open(output_file, "w") as fp:
-            json.dump(report, fp, indent=4, sort_keys=False)
+        write_report(report, Path(metadata_path).stem, version)
 
         assert (
             valid_schema
@@ -81,15 +85,16 @@ def test_compilance(metadata_path, version):
 def main():
     _, filename, (dd, mm, yyyy) = get_clean_data()
 
-    original = f"{FAIRDIR}/{filename}.json"
+    original = f"{get_output_dir(FAIRDIR)}/{filename}.json"
     normalised = (
-        f"{NORMALISEDIR}/{NORMALIZED_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
+        f"{get_output_dir(NORMALISEDIR)}/{NORMALIZED_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
     )
     renamed = (
-        f"{OEPDIR_DEFAULT}/{OEP_REGULAR_FILEANAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
+        f"{get_output_dir(DEFAULT_DIR)}/{OEP_REGULAR_FILEANAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
     )
     renamed_normalised = (
-        f"{OEPDIR_NORMAL}/{OEP_NORMAL_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
+        f"{get_output_dir(BUNDLE_DIR)}/{BUNDLE_DIRNAME.format(mm=mm, dd=dd, yyyy=yyyy)}/"
+        f"{OEP_NORMAL_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
     )
     for d in [original, normalised, renamed, renamed_normalised]:
         test_compilance(d, "v152")
@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+import re
+from .normalise import get_normalised_data
+from .output import write_csv
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+INDEXDIR = "index"
+INDEX_FILENAME = "evse_index_{dd}_{mm}_{yyyy}.csv"
+REPORTDIR = "reports"
+REPORT_FILENAME = "evse_{dd}_{mm}_{yyyy}.csv"
+
+# EVSE-IDs like DE*ABC*E123456*1 are compared without separators and case
+SEPARATORS = re.compile(r"[\s*\-_]")
+# A point may list several EVSE-IDs
+LIST_SEPARATORS = r"[;,]"
+EVSE_PATTERN = re.compile(r"([A-Z]{2})([A-Z0-9]{3})E([A-Z0-9]{1,31})")
+PARSED_COLUMNS = ["country", "operator", "local", "evse_id"]
+INDEX_COLUMNS = ["point_id", "column_id", "country", "operator", "local"]
+
+
+def parse_evse_id(value):
+    """Return country, operator id, local id and normalised EVSE-ID, None if malformed."""
+    if not isinstance(value, str):
+        return None
+    match = EVSE_PATTERN.fullmatch(SEPARATORS.sub("", value.upper()))
+    if match is None:
+        return None
+    country, operator, local = match.groups()
+    return country, operator, local, f"{country}*{operator}*E{local}"
+
+
+def parse_evse_ids(values):
+    """
+    Parse EVSE-IDs into country, operator id and local id.
+
+    Returns the parts and the normalised EVSE-ID, all missing for malformed ids.
+    Every distinct value is only parsed once.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    parsed = [parse_evse_id(value) for value in uniques]
+    # The last row is taken by the missing values, coded as -1
+    parsed = pd.DataFrame(
+        [p or (None,) * len(PARSED_COLUMNS) for p in parsed]
+        + [(None,) * len(PARSED_COLUMNS)],
+        columns=PARSED_COLUMNS,
+        dtype=object,
+    )
+    return parsed.iloc[codes].reset_index(drop=True)
+
+
+def get_evse_table(point_data):
+    """Return every EVSE-ID of the points with its parsed parts."""
+    raw = (
+        point_data["EVSE-ID"]
+        .dropna()
+        .astype(str)
+        .str.split(LIST_SEPARATORS)
+        .explode()
+        .str.strip()
+    )
+    raw = raw[raw != ""]
+    evse_table = pd.DataFrame(
+        {
+            "point_id": raw.index,
+            "column_id": point_data.loc[raw.index, "column_id"].to_numpy(),
+            "raw": raw.to_numpy(),
+        }
+    )
+    return evse_table.join(parse_evse_ids(evse_table["raw"]))
+
+
+def build_index(evse_table):
+    """
+    Build the index from normalised EVSE-ID to point and column.
+
+    EVSE-IDs used by more than one point are left out of the index, as a lookup
+    could not tell the points apart. Returns the index and a report of the
+    malformed and duplicated EVSE-IDs.
+    """
+    malformed = evse_table["evse_id"].isna()
+    valid = evse_table[~malformed]
+    duplicated = valid["evse_id"].duplicated(keep=False)
+    index = valid[~duplicated].set_index("evse_id")[INDEX_COLUMNS].sort_index()
+
+    report = pd.concat(
+        [
+            evse_table[malformed].assign(problem="malformed"),
+            valid[duplicated].assign(problem="duplicate"),
+        ]
+    )
+    report = report[["point_id", "column_id", "raw", "evse_id", "problem"]]
+    return index, report
+
+
+def read_index(file_path):
+    """Read a persisted index, its EVSE-ID index is a hash table."""
+    return pd.read_csv(
+        file_path,
+        index_col="evse_id",
+        dtype={"point_id": "int64", "column_id": "int64"},
+        keep_default_na=False,
+        encoding="utf-8",
+    )
+
+
+def lookup(index, evse_ids):
+    """
+    Look up a batch of EVSE-IDs in the index.
+
+    The EVSE-IDs are normalised first, unknown and malformed ids get missing values.
+    """
+    keys = parse_evse_ids(evse_ids)["evse_id"]
+    # The index is unique, so reindex is a hash lookup per EVSE-ID
+    result = (
+        index[["point_id", "column_id"]]
+        .reindex(keys.to_numpy())
+        .astype("Int64")
+        .reset_index(drop=True)
+    )
+    result.insert(0, "evse_id", list(evse_ids))
+    return result
+
+
+def main():
+    data, _, _, (dd, mm, yyyy) = get_normalised_data()
+    index, report = build_index(get_evse_table(data["point"]))
+
+    write_csv(
+        index,
+        f"{get_output_dir(INDEXDIR)}/{INDEX_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}",
+    )
+    write_csv(
+        report,
+        f"{get_output_dir(REPORTDIR)}/{REPORT_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}",
+        index=False,
+    )
+    print(f"{len(index)} EVSE-IDs indexed")
+    for problem, count in report["problem"].value_counts().items():
+        print(f"{count} EVSE-IDs are {problem}")
+
+
+if __name__ == "__main__":
+    main()
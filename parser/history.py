@@ -0,0 +1,253 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Keep the history of the charging columns across snapshots.
+
+The history is append-only. A snapshot only appends the columns that are new or
+whose fingerprint changed, with the date of the snapshot as valid_from, and a
+tombstone for every column that disappeared. A version is valid until the next
+version of its column, so the history grows with the changes, not with the
+snapshots. The fingerprints are hashed from the canonical text of the cells, so
+a column does not change when pandas infers other types for a workbook. The
+public keys are stored themselves, their references are only valid within a
+snapshot. A subset run keeps its own history, see parser/subset.py.
+"""
+
+from glob import glob
+from os import path, makedirs, replace
+from .clean import FINGERPRINT, get_clean_data, get_public_keys
+from .dates import DATE_COLUMNS, DATE_FORMAT, DATETIME_FORMAT, format_date_columns
+from .keys import restore_keys
+from .load import DATA_DIRECTORY, probe_workbook
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+HISTORYDIR = "history"
+HISTORY_FILENAME = "bnetza_history.csv"
+SNAPSHOTS_FILENAME = "bnetza_snapshots.csv"
+
+ID = "Ladeeinrichtungs-ID"
+VALID_FROM = "valid_from"
+VALID_TO = "valid_to"
+DELETED = "deleted"
+HISTORY_COLUMNS = [ID, VALID_FROM, DELETED]
+
+
+def get_history_dir(history_dir: str | None = None):
+    """Return the history directory, the one of the subset in subset mode by default."""
+    return get_output_dir(HISTORYDIR) if history_dir is None else history_dir
+
+
+def get_history_path(filename: str, history_dir: str | None = None):
+    return path.join(get_history_dir(history_dir), filename)
+
+
+def read_snapshots(history_dir: str | None = None):
+    """Return the dates of the snapshots in the history, oldest first."""
+    file_path = get_history_path(SNAPSHOTS_FILENAME, history_dir)
+    if not path.exists(file_path):
+        return pd.DatetimeIndex([], name=VALID_FROM)
+    snapshots = pd.read_csv(
+        file_path, parse_dates=[VALID_FROM], date_format=DATE_FORMAT, encoding="utf-8"
+    )
+    return pd.DatetimeIndex(snapshots[VALID_FROM])
+
+
+def read_history(history_dir: str | None = None):
+    """
+    Read the history with the end of the validity of every version.
+
+    The versions are sorted by valid_from, versions valid until today have no
+    valid_to.
+    """
+    file_path = get_history_path(HISTORY_FILENAME, history_dir)
+    if not path.exists(file_path):
+        return pd.DataFrame(columns=HISTORY_COLUMNS + [FINGERPRINT, VALID_TO])
+    history = pd.read_csv(
+        file_path,
+        dtype={FINGERPRINT: "Int64", DELETED: bool},
+        parse_dates=[VALID_FROM] + DATE_COLUMNS,
+        date_format={
+            VALID_FROM: DATE_FORMAT,
+            **dict.fromkeys(DATE_COLUMNS, DATETIME_FORMAT),
+        },
+        low_memory=False,
+        encoding="utf-8",
+    )
+    history = history.sort_values([ID, VALID_FROM], kind="stable")
+    history[VALID_TO] = history.groupby(ID)[VALID_FROM].shift(-1)
+    return history.sort_values([VALID_FROM, ID], kind="stable").reset_index(drop=True)
+
+
+def get_current(history):
+    """Return the latest version of every column, tombstones included."""
+    return history.drop_duplicates(ID, keep="last").set_index(ID)
+
+
+def get_state(history, date):
+    """Return the columns as they were on a date, indexed by their id."""
+    date = pd.Timestamp(date)
+    # The history is sorted by valid_from, so the versions started by the date are a prefix
+    end = history[VALID_FROM].searchsorted(date, side="right")
+    state = get_current(history.iloc[:end])
+    return state[~state[DELETED].astype(bool)].drop(columns=[DELETED, VALID_TO])
+
+
+def get_column_index(history):
+    """
+    Return the history sorted by id and valid_from and indexed by id.
+
+    Build it once to look up the versions of many columns with get_versions.
+    """
+    return history.sort_values([ID, VALID_FROM], kind="stable").set_index(
+        ID, drop=False
+    )
+
+
+def get_versions(history, column_id, field: str | None = None):
+    """
+    Return the versions of a column, oldest first.
+
+    history is best indexed by get_column_index, then the versions are found by
+    binary search. With a field, only the versions that changed the field are
+    returned.
+    """
+    if history.index.name != ID or not history.index.is_monotonic_increasing:
+        history = get_column_index(history)
+    start = history.index.searchsorted(column_id, side="left")
+    end = history.index.searchsorted(column_id, side="right")
+    versions = history.iloc[start:end].reset_index(drop=True)
+    if field is not None:
+        values = versions[field].astype(object).where(versions[field].notna(), None)
+        versions = versions[values.ne(values.shift()).to_numpy()]
+    return versions
+
+
+def get_changes(snapshot, current, date):
+    """
+    Return the rows to append for a snapshot.
+
+    These are the new and changed columns and tombstones of the removed ones.
+    """
+    known = current[~current[DELETED].astype(bool)]
+    # A column is unchanged if its latest version has the same fingerprint, it
+    # does not depend on the types inferred for the columns of the workbook
+    unchanged = pd.MultiIndex.from_arrays([snapshot[ID], snapshot[FINGERPRINT]]).isin(
+        pd.MultiIndex.from_arrays([known.index, known[FINGERPRINT]])
+    )
+    changed = snapshot[~unchanged]
+    removed = known.index.difference(snapshot[ID])
+    tombstones = pd.DataFrame({ID: removed, DELETED: True})
+    # Tombstones have no fingerprint, as floats the fingerprints would be rounded
+    changed = changed.assign(
+        **{FINGERPRINT: changed[FINGERPRINT].astype("Int64"), DELETED: False}
+    )
+    changes = pd.concat([changed, tombstones], ignore_index=True)
+    changes[DELETED] = changes[DELETED].astype(bool)
+    changes.insert(1, VALID_FROM, pd.Timestamp(date))
+    return changes
+
+
+def add_header_columns(history_path: str, columns: list):
+    """
+    Add columns to the header of the history file, the earlier rows leave them empty.
+
+    The file is only rewritten when the source gains columns.
+    """
+    history = pd.read_csv(
+        history_path, dtype=str, keep_default_na=False, encoding="utf-8"
+    )
+    history = history.reindex(columns=list(history.columns) + columns, fill_value="")
+    temp_path = f"{history_path}.tmp"
+    history.to_csv(temp_path, index=False, encoding="utf-8")
+    replace(temp_path, history_path)
+
+
+def add_snapshot(snapshot, date, history_dir: str | None = None):
+    """
+    Append the changes of a cleaned snapshot to the history.
+
+    Snapshots have to be added in the order of their dates, a snapshot that is
+    already in the history is skipped. Returns the number of new, changed and
+    removed columns.
+    """
+    date = pd.Timestamp(date)
+    snapshots = read_snapshots(history_dir)
+    if date in snapshots:
+        return None
+    if len(snapshots) and date < snapshots.max():
+        raise ValueError(
+            f"The snapshot of {date:%Y-%m-%d} is older than the latest one in the history"
+        )
+    if snapshot[ID].duplicated().any():
+        raise ValueError(f"The snapshot of {date:%Y-%m-%d} has duplicated {ID}")
+
+    history = read_history(history_dir)
+    current = get_current(history)
+    changes = get_changes(snapshot, current, date)
+    counts = {
+        "new": int((~changes[ID].isin(current.index) & ~changes[DELETED]).sum()),
+        "changed": int((changes[ID].isin(current.index) & ~changes[DELETED]).sum()),
+        "removed": int(changes[DELETED].sum()),
+    }
+
+    makedirs(get_history_dir(history_dir), exist_ok=True)
+    history_path = get_history_path(HISTORY_FILENAME, history_dir)
+    if path.exists(history_path):
+        columns = [c for c in history.columns if c != VALID_TO]
+        # New source columns are added, removed ones stay empty
+        unknown = [c for c in changes.columns if c not in columns]
+        if unknown:
+            add_header_columns(history_path, unknown)
+            columns += unknown
+        changes = changes.reindex(columns=columns)
+    changes = format_date_columns(changes, DATETIME_FORMAT)
+    changes[VALID_FROM] = f"{date:%Y-%m-%d}"
+    # Appended like the registry, the rows of earlier snapshots are never rewritten
+    changes.to_csv(
+        history_path,
+        mode="a",
+        header=not path.exists(history_path),
+        index=False,
+        encoding="utf-8",
+    )
+    snapshots_path = get_history_path(SNAPSHOTS_FILENAME, history_dir)
+    pd.DataFrame({VALID_FROM: [f"{date:%Y-%m-%d}"]}).to_csv(
+        snapshots_path,
+        mode="a",
+        header=not path.exists(snapshots_path),
+        index=False,
+        encoding="utf-8",
+    )
+    return counts
+
+
+def get_history_snapshot(
+    filename: str | None = None, download_date: tuple | None = None
+):
+    """Return a cleaned snapshot with its public keys and its date."""
+    df, _, (dd, mm, yyyy) = get_clean_data(filename, download_date)
+    df = restore_keys(df, get_public_keys(dd, mm, yyyy))
+    return df, pd.Timestamp(f"{yyyy}-{mm}-{dd}")
+
+
+def main():
+    known = set(read_snapshots())
+    # The workbooks are added in the order of their dates, read from their first rows
+    workbooks = sorted(
+        (pd.Timestamp("-".join(reversed(probe_workbook(f)["date"]))), f)
+        for f in glob(path.join(DATA_DIRECTORY, "*.xlsx"))
+    )
+    for date, workbook in workbooks:
+        if date in known:
+            continue
+        snapshot, date = get_history_snapshot(workbook)
+        counts = add_snapshot(snapshot, date)
+        print(f"{date:%Y-%m-%d}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+KEY_COLUMNS = [f"Public Key{n}" for n in range(1, 7)]
+KEY_ID_COLUMNS = [f"Public Key ID{n}" for n in range(1, 7)]
+KEY_ID = "Public Key ID"
+KEY_COLUMN = "PublicKey"
+KEY_FILENAME = "bnetza_public_keys_{dd}_{mm}_{yyyy}"
+
+KEY_ANNOTATIONS = {
+    KEY_COLUMN: {
+        "description": "Public key of a charging point, every distinct key is stored once.",
+        "isAbout": [
+            {
+                "name": "public key",
+                "path": "https://openenergy-platform.org/missing_term",
+            }
+        ],
+    },
+    KEY_ID: {"description": "Reference to the public key of the charging point."},
+}
+
+
+def externalise_keys(df):
+    """
+    Replace the public key columns by references to a table of the distinct keys.
+
+    Returns the frame with the reference columns in place of the key columns and
+    the key table.
+    """
+    codes, uniques = pd.factorize(df[KEY_COLUMNS].to_numpy().ravel())
+    ids = pd.DataFrame(
+        codes.reshape(len(df), len(KEY_COLUMNS)),
+        index=df.index,
+        columns=KEY_COLUMNS,
+    ).astype("Int64")
+    # Missing keys are coded as -1
+    df[KEY_COLUMNS] = ids.mask(ids < 0)
+    df = df.rename(columns=dict(zip(KEY_COLUMNS, KEY_ID_COLUMNS)))
+
+    keys = pd.DataFrame({KEY_COLUMN: uniques})
+    keys.index.name = "id"
+    return df, keys
+
+
+def restore_keys(df, keys, id_columns=KEY_ID_COLUMNS, key_columns=KEY_COLUMNS):
+    """
+    Replace the reference columns by the public keys of the key table.
+
+    The references are only valid with the key table of their snapshot, the
+    keys themselves can be compared across snapshots. id_columns and
+    key_columns give the names of renamed frames.
+    """
+    df = df.copy(deep=False)
+    for column in id_columns:
+        df[column] = df[column].map(keys[KEY_COLUMN])
+    return df.rename(columns=dict(zip(id_columns, key_columns)))
+
+
+def read_keys(file_path):
+    """Read a key table."""
+    return pd.read_csv(
+        file_path, index_col="id", dtype={KEY_COLUMN: str}, encoding="utf-8"
+    )
+
+
+def get_key_resource(name: str, path: str):
+    """Return the frictionless resource of a key table."""
+    return {
+        "profile": "tabular-data-resource",
+        "name": name,
+        "path": path,
+        "format": "csv",
+        "encoding": "utf-8",
+        "schema": {
+            "fields": [
+                {"name": "id", "type": "integer", "description": "Unique identifier"},
+                {"name": KEY_COLUMN, "type": "string", **KEY_ANNOTATIONS[KEY_COLUMN]},
+            ],
+            "primaryKey": ["id"],
+        },
+    }
@@ -0,0 +1,37 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """
+    Return a module that is only executed on its first attribute access.
+
+    Stages that never touch a heavy dependency, like evaluate with frictionless,
+    do not pay for importing it.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def preload(*modules):
+    """
+    Execute lazy modules now.
+
+    Modules used by concurrent workers are loaded before the workers start, so
+    the import is not paid inside the first task while the other workers wait
+    for it, and forked workers inherit the loaded module.
+    """
+    for module in modules:
+        module.__dict__.keys()
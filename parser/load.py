@@ -1,12 +1,30 @@
 # SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
 # SPDX-License-Identifier: BSD-3-Clause
 
+import hashlib
+import re
+import zipfile
 from datetime import datetime
-from os import path, mkdir
+from functools import lru_cache
+from os import path, mkdir, stat
+from xml.etree.ElementTree import iterparse
 
 FILENAME = "bnetza_charging_stations_raw_{MM}_{YYYY}.xlsx"
 DATA_DIRECTORY = "sources/BNETZA"
 
+# Row of the column names in the workbook, the rows above hold the title and the date
+HEADER_ROW = 11
+STAND_PATTERN = re.compile(r"Stand:?\s*(\d{1,2})\.(\d{1,2})\.(\d{4})")
+HASH_CHUNK_SIZE = 1 << 20
+# Number of workbooks whose probe is kept, history probes every snapshot
+PROBE_CACHE_SIZE = 64
+
+SPREADSHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIP_NS = (
+    "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+)
+PACKAGE_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
 
 def get_raw(dd_mm_yyyy: tuple | None = None):
     if dd_mm_yyyy is None:
@@ -25,6 +43,156 @@ def get_raw(dd_mm_yyyy: tuple | None = None):
     return file_path
 
 
+def get_file_hash(file_path):
+    """Return the SHA256 of the file content."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_first_sheet(archive):
+    """Return the path of the first worksheet in the xlsx archive."""
+    with archive.open("xl/workbook.xml") as f:
+        _, sheet = next(
+            (event, element)
+            for event, element in iterparse(f)
+            if element.tag == f"{SPREADSHEET_NS}sheet"
+        )
+    relationship_id = sheet.get(f"{RELATIONSHIP_NS}id")
+    with archive.open("xl/_rels/workbook.xml.rels") as f:
+        for _, element in iterparse(f):
+            if (
+                element.tag == f"{PACKAGE_NS}Relationship"
+                and element.get("Id") == relationship_id
+            ):
+                target = element.get("Target")
+                break
+    # Targets are either absolute or relative to xl/
+    return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+
+def get_shared_strings(archive, count: int):
+    """Return the first count shared strings of the xlsx archive."""
+    strings = []
+    if count <= 0 or "xl/sharedStrings.xml" not in archive.namelist():
+        return strings
+    with archive.open("xl/sharedStrings.xml") as f:
+        for _, element in iterparse(f):
+            if element.tag == f"{SPREADSHEET_NS}si":
+                strings.append(
+                    "".join(t.text or "" for t in element.iter(f"{SPREADSHEET_NS}t"))
+                )
+                element.clear()
+                if len(strings) >= count:
+                    break
+    return strings
+
+
+def get_column_index(reference: str):
+    """Return the zero based column index of a cell reference like BA11."""
+    index = 0
+    for character in reference:
+        if not character.isalpha():
+            break
+        index = index * 26 + ord(character.upper()) - ord("A") + 1
+    return index - 1
+
+
+def read_first_rows(archive, sheet: str, last_row: int):
+    """
+    Read the rows up to last_row of a worksheet without parsing the rest.
+
+    Returns the rows as dictionaries from column index to value, and the last row
+    given by the dimension of the sheet.
+    """
+    rows = {}
+    shared = {}
+    dimension = None
+    with archive.open(sheet) as f:
+        for _, element in iterparse(f):
+            if element.tag == f"{SPREADSHEET_NS}dimension":
+                dimension = element.get("ref")
+            elif element.tag == f"{SPREADSHEET_NS}row":
+                number = int(element.get("r"))
+                if number > last_row:
+                    break
+                cells = {}
+                for cell in element.iter(f"{SPREADSHEET_NS}c"):
+                    column = get_column_index(cell.get("r"))
+                    cell_type = cell.get("t")
+                    if cell_type == "inlineStr":
+                        cells[column] = "".join(
+                            t.text or "" for t in cell.iter(f"{SPREADSHEET_NS}t")
+                        )
+                    elif (value := cell.find(f"{SPREADSHEET_NS}v")) is not None:
+                        cells[column] = value.text
+                        if cell_type == "s":
+                            shared[(number, column)] = int(value.text)
+                rows[number] = cells
+                element.clear()
+
+    # Only the shared strings up to the highest index used are read
+    strings = get_shared_strings(archive, max(shared.values(), default=-1) + 1)
+    for (number, column), index in shared.items():
+        rows[number][column] = strings[index]
+
+    max_row = None
+    if dimension and ":" in dimension:
+        max_row = int(re.sub(r"^[A-Z]+", "", dimension.split(":")[1]))
+    return rows, max_row
+
+
+def probe_workbook(file_path, header_row: int = HEADER_ROW, file_hash: bool = True):
+    """
+    Read the metadata of a raw workbook without parsing the whole sheet.
+
+    Returns the snapshot date as (dd, mm, yyyy), the header fields, the
+    approximate number of data rows from the sheet dimension (None if the
+    workbook has no dimension) and the SHA256 of the file, None without
+    file_hash. The probe is read again only when the size or the modification
+    time of the file changed.
+    """
+    status = stat(file_path)
+    probe = read_probe(
+        path.abspath(file_path),
+        header_row,
+        file_hash,
+        status.st_size,
+        status.st_mtime_ns,
+    )
+    return {**probe, "fields": list(probe["fields"])}
+
+
+@lru_cache(maxsize=PROBE_CACHE_SIZE)
+def read_probe(file_path, header_row: int, file_hash: bool, size: int, modified: int):
+    """Probe a workbook, size and modified only key the cache."""
+    with zipfile.ZipFile(file_path) as archive:
+        rows, max_row = read_first_rows(archive, get_first_sheet(archive), header_row)
+
+    date = None
+    for number in sorted(rows):
+        for value in rows[number].values():
+            if match := STAND_PATTERN.search(str(value)):
+                date = match.groups()
+                break
+        if date:
+            break
+    if date is None:
+        raise ValueError(f"No snapshot date (Stand) found in {file_path}")
+    dd, mm, yyyy = date
+
+    header = rows.get(header_row, {})
+    fields = [header.get(i) for i in range(max(header, default=-1) + 1)]
+    return {
+        "date": (dd.zfill(2), mm.zfill(2), yyyy),
+        "fields": fields,
+        "rows": max_row - header_row if max_row is not None else None,
+        "sha256": get_file_hash(file_path) if file_hash else None,
+    }
+
+
 def main():
     get_raw()
 
@@ -1,16 +1,26 @@
 # SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
 # SPDX-License-Identifier: BSD-3-Clause
 
-from .annotate import get_clean_data, INPUT_METADATA_FILE
-import pandas as pd
-import yaml
-import frictionless as fl
+from .annotate import get_clean_data, get_metadata_file
+from .registry import get_stable_ids, load_registry
+from .clean import get_public_keys
+from .keys import KEY_ANNOTATIONS, KEY_FILENAME, KEY_ID
+from .opening import get_opening_masks, OPENING_ANNOTATIONS
+from .operators import get_canonical_operators
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from copy import deepcopy
-import json
-from os import mkdir, path
+from .output import write_csv, write_json
+from .dates import DATETIME_FORMAT
+from .subset import describe_subset, get_output_dir
+from os import makedirs, path
 from zlib import crc32
-import numpy as np
+from .lazy import lazy_import, preload
+
+pd = lazy_import("pandas")
+yaml = lazy_import("yaml")
+fl = lazy_import("frictionless")
+np = lazy_import("numpy")
 
 COLUMN_DATA = "bnetza_charging_columns_{dd}_{mm}_{yyyy}"
 FACILITY_DATA = "bnetza_facilities_{dd}_{mm}_{yyyy}"
@@ -24,6 +34,33 @@ COMPATIBILITY_DATA = "bnetza_compatibility_{dd}_{mm}_{yyyy}"
 SOCKET_DATA = "bnetza_charging_sockets_{dd}_{mm}_{yyyy}"
 NORMALISEDIR = "normalised"
 
+# Emit 64 bit integer keys for addresses, coordinates, geolocations and facilities
+INTEGER_KEYS = False
+# Column holding the string form of integer keys
+STRING_ID = "string_id"
+# Merge the spelling variants of an operator, see parser/operators.py
+CANONICAL_OPERATORS = True
+
+# Order of the tables in the bundle
+TABLES = [
+    "column",
+    "facility",
+    "point",
+    "operator",
+    "geolocation",
+    "socket",
+    "compatibility",
+    "address",
+    "coordinate",
+    "key",
+]
+# Executors of the table construction and of the resource descriptions, one
+# of "serial", "thread" or "process". Measure with benchmarks/normalise.py.
+TABLE_EXECUTOR = "thread"
+RESOURCE_EXECUTOR = "thread"
+MAX_WORKERS = 4
+EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
 CONNECTION_TYPE_MAP = {
     "AC Typ 2 Steckdose": "ac_iec62196t2_socket",
     "AC Typ 2 Fahrzeugkupplung": "ac_iec62196t2_cable",
@@ -53,6 +90,17 @@ def describe_and_annotate(
 
     # Add common annotations
     annotation_fields["id"] = {"description": "Unique identifier"}
+    if STRING_ID in fields:
+        annotation_fields[STRING_ID] = {
+            "description": "String form of the identifier as used by releases without integer keys"
+        }
+    annotation_fields.update(
+        {
+            k: v
+            for k, v in (OPENING_ANNOTATIONS | KEY_ANNOTATIONS).items()
+            if k in fields.keys()
+        }
+    )
     for k, v in annotation_fields.items():
         fields[k].update(v)
 
@@ -89,69 +137,108 @@ def create_foreign_key(fields, reference_resource, reference_fields):
     }
 
 
+def get_address_ids(addresses):
+    """String ids of addresses from the CRC32 of the joined address fields."""
+    return addresses.apply(
+        lambda x: str(
+            crc32(
+                "".join(
+                    [str(y).replace("nan", "").replace("None", "") for y in x]
+                ).encode("utf8")
+            )
+        ),
+        axis=1,
+    )
+
+
+def get_coordinate_ids(coordinates):
+    """String ids of coordinates from the scaled latitude and longitude."""
+    return coordinates.apply(
+        lambda x: (
+            str(int(x["Breitengrad"] * 100000))
+            + str(int(x["Längengrad"] * 100000)).replace("-", "1")
+        ),
+        axis=1,
+    )
+
+
+def get_geolocation_ids(address_ids, coordinate_ids):
+    """String ids of geolocations from the truncated address id and the coordinate id."""
+    return (
+        "A"
+        + address_ids.astype(str).str.zfill(6).str[:6]
+        + "S"
+        + coordinate_ids.fillna("").astype(str).str.zfill(14)
+    )
+
+
+def get_facility_ids(operator_ids, address_ids):
+    """String ids of facilities from the operator id and the truncated address id."""
+    return (
+        operator_ids.astype(str).str.zfill(6)
+        + address_ids.astype(str).str.zfill(6).str[:6]
+    )
+
+
+def get_integer_keys(data, kind: str):
+    """
+    Hash every row of the data to a 64 bit integer key.
+
+    Raises a ValueError if two distinct rows get the same key.
+    """
+    keys = pd.Series(
+        pd.util.hash_pandas_object(data, index=False).to_numpy().view("int64"),
+        index=data.index,
+    )
+    distinct = keys[~data.duplicated()]
+    collisions = distinct.duplicated().sum()
+    if collisions:
+        raise ValueError(f"{collisions} {kind} keys collide")
+    return keys
+
+
 def process_resources(data_dict, annotations, filenames, foreign_key_map):
     """
     Process all resources by describing, annotating, and creating resource dictionaries.
     """
-    resources = []
+    preload(fl)
+    tasks = []
     for key, data in data_dict.items():
         resource_name = filenames[key]
         primary_key = "id"
         foreign_keys = foreign_key_map.get(key, None)
-        resource = describe_and_annotate(
-            data, annotations, resource_name, primary_key, foreign_keys
+        tasks.append(
+            (
+                describe_and_annotate,
+                (data, annotations, resource_name, primary_key, foreign_keys),
+            )
         )
-        resources.append(resource)
-    return resources
-
-
-def get_normalised_data(
-    filename: str | None = None, download_date: tuple | None = None
-):
-    df, filename, (dd, mm, yyyy) = get_clean_data(filename, download_date)
-
-    df = df.set_index("Ladeeinrichtungs-ID")
-    df.index.name = "id"
-
-    column_data = df.iloc[:, :22]
-
-    # socket data
-    ci = "column_id"
-    oi = "operator_id"
-    gi = "geolocation_id"
-    pi = "point_id"
-    si = "socket_id"
-    fi = "facility_id"
-    ai = "address_id"
-    coi = "coordinate_id"
+    return run_tasks(tasks, RESOURCE_EXECUTOR)
 
-    column_names = ["Steckertypen", "Leistungskapazität", "EVSE-ID", "Key"]
-    point_data_1 = df.iloc[:, 22:26]
-    point_data_1.columns = [column_names]
-    point_data_2 = df.iloc[:, 26:30]
-    point_data_2.columns = [column_names]
-    point_data_3 = df.iloc[:, 30:34]
-    point_data_3.columns = [column_names]
-    point_data_4 = df.iloc[:, 34:38]
-    point_data_4.columns = [column_names]
-    point_data_5 = df.iloc[:, 38:42]
-    point_data_5.columns = [column_names]
-    point_data_6 = df.iloc[:, 42:46]
-    point_data_6.columns = [column_names]
 
+def get_point_tables(df):
+    """
+    Split the charging points of the columns into point, socket and compatibility tables.
+    """
+    column_names = ["Steckertypen", "Leistungskapazität", KEY_ID, "EVSE-ID"]
+    # The columns of every point are selected by name, their order differs from column_names
     point_data = pd.concat(
         [
-            point_data_1.reset_index(),
-            point_data_2.reset_index(),
-            point_data_3.reset_index(),
-            point_data_4.reset_index(),
-            point_data_5.reset_index(),
-            point_data_6.reset_index(),
+            df[
+                [
+                    f"Steckertypen{n}",
+                    f"Nennleistung Stecker{n}",
+                    f"{KEY_ID}{n}",
+                    f"EVSE-ID{n}",
+                ]
+            ]
+            .set_axis(column_names, axis=1)
+            .reset_index()
+            for n in range(1, 7)
         ],
         ignore_index=True,
     ).rename(columns={"id": "column_id"})
 
-    point_data.columns = [c[0] for c in point_data.columns]
     point_data.dropna(
         subset=column_names,
         how="all",
@@ -162,16 +249,6 @@ def get_normalised_data(
     point_data.drop(columns="index", inplace=True)
     point_data.index.name = "id"
 
-    point_filename = POINT_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    column_filename = COLUMN_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    facility_filename = FACILITY_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    operator_filename = OPERATOR_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    geolocation_filename = GEOLOCATION_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    address_filename = ADDRESS_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    coordinate_filename = COORDINATE_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    socket_filename = SOCKET_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-    compatibility_filename = COMPATIBILITY_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
-
     point_data["types_temp"] = (
         point_data["Steckertypen"]
         .str.replace(";", ",")
@@ -195,7 +272,7 @@ def get_normalised_data(
         ),
         axis=1,
     )
-    socket_types = [
+    socket_types = sorted(
         it
         for it in set(
             item.strip()
@@ -206,12 +283,14 @@ def get_normalised_data(
             for item in sublist
         )
         if len(it) > 0
-    ]
+    )
     socket_data = pd.DataFrame({"name": socket_types})
+    socket_data.index = get_stable_ids(socket_data["name"], "socket")
     socket_data[["current", "pattern", "connector", "power"]] = socket_data[
         "name"
     ].str.split("_", expand=True)
     socket_data = socket_data.applymap(lambda v: v if v != "None" else None)
+    socket_data = socket_data.sort_index()
     socket_data.index.name = "id"
 
     compatibility_base = pd.DataFrame(
@@ -247,22 +326,34 @@ def get_normalised_data(
         inplace=True,
     )
     socket_data.drop(columns=["name"], inplace=True)
-    # Separate operators
-    column_data["Betreiber"] = column_data["Betreiber"].str.strip()
-    operator_data = pd.DataFrame({"Betreiber": column_data["Betreiber"].unique()})
-    operator_data.sort_values(by="Betreiber")
+
+    return {
+        "point": point_data,
+        "socket": socket_data,
+        "compatibility": compatibility_data,
+    }
+
+
+def get_operator_table(column_data):
+    """
+    Separate the operators of the columns.
+    """
+    oi = "operator_id"
+    operator_data = (
+        column_data[[oi, "Betreiber"]].drop_duplicates().set_index(oi).sort_index()
+    )
     operator_data.index.name = "id"
-    new_columns = pd.merge(
-        column_data.reset_index(),
-        operator_data.reset_index()[["Betreiber", "id"]],
-        left_on="Betreiber",
-        right_on="Betreiber",
-        how="left",
-        sort=False,
-    ).set_index("id_x")
-    new_columns.index.name = "id"
-    column_data.insert(loc=1, column=oi, value=new_columns["id_y"])
-    column_data.drop(columns=["Betreiber"], inplace=True)
+    return {"operator": operator_data}
+
+
+def get_location_tables(column_data, integer_keys: bool):
+    """
+    Separate the facilities and locations of the columns.
+    """
+    gi = "geolocation_id"
+    fi = "facility_id"
+    ai = "address_id"
+    coi = "coordinate_id"
 
     # Separate locations
     address_columns = [
@@ -284,25 +375,14 @@ def get_normalised_data(
         lambda x: x.str.strip()
     )
 
-    column_data[ai] = column_data[address_columns].apply(
-        lambda x: str(
-            crc32(
-                "".join(
-                    [str(y).replace("nan", "").replace("None", "") for y in x]
-                ).encode("utf8")
-            )
-        ),
-        axis=1,
-    )
-    column_data[coi] = column_data[coordinate_columns].apply(
-        lambda x: str(int(x["Breitengrad"] * 100000))
-        + str(int(x["Längengrad"] * 100000)).replace("-", "1"),
-        axis=1,
-    )
-    column_data["geolocation_id"] = column_data.apply(
-        lambda x: "A" + str(x[ai]).zfill(6)[0:6] + "S" + str(x[coi]),
-        axis=1,
-    )
+    if integer_keys:
+        column_data[ai] = get_integer_keys(column_data[address_columns], "address")
+        column_data[coi] = get_integer_keys(
+            column_data[coordinate_columns], "coordinate"
+        ).astype("Int64")
+    else:
+        column_data[ai] = get_address_ids(column_data[address_columns])
+        column_data[coi] = get_coordinate_ids(column_data[coordinate_columns])
 
     address_data = column_data[address_columns + [ai]]
     address_data = (
@@ -355,12 +435,16 @@ def get_normalised_data(
     uniques = facility_data_pre[~dup_filter]
 
     facility_data = pd.concat([uniques, duplicated])
-    facility_data["id"] = facility_data.apply(
-        lambda row: str(row["operator_id"]).zfill(6) + str(row[ai]).zfill(6)[:6],
-        axis=1,
-    )
-    facility_data[coi] = facility_data.apply(
-        lambda row: row[coi] if row["coord_points_facility"] else None, axis=1
+    if integer_keys:
+        facility_data["id"] = get_integer_keys(
+            facility_data[["operator_id", ai]], "facility"
+        )
+    else:
+        facility_data["id"] = get_facility_ids(
+            facility_data["operator_id"], facility_data[ai]
+        )
+    facility_data[coi] = facility_data[coi].where(
+        facility_data["coord_points_facility"], None
     )
     column_data = column_data.join(
         facility_data[["operator_id", ai, "id"]].set_index(["operator_id", ai]),
@@ -368,24 +452,12 @@ def get_normalised_data(
         how="left",
     ).rename(columns={"id": "facility_id"})
 
-    column_data[coi] = column_data.apply(
-        lambda row: row[coi] if row["coord_points_column"] else None, axis=1
-    )
-    column_data["geolocation_id"] = column_data.apply(
-        lambda x: "A"
-        + str(x[ai]).zfill(6)[0:6]
-        + "S"
-        + str(x[coi]).replace("None", "").zfill(14),
-        axis=1,
-    )
-
-    facility_data["geolocation_id"] = facility_data.apply(
-        lambda x: "A"
-        + str(x[ai]).zfill(6)[0:6]
-        + "S"
-        + str(x[coi]).replace("None", "").zfill(14),
-        axis=1,
-    )
+    column_data[coi] = column_data[coi].where(column_data["coord_points_column"], None)
+    for data in [column_data, facility_data]:
+        if integer_keys:
+            data["geolocation_id"] = get_integer_keys(data[[ai, coi]], "geolocation")
+        else:
+            data["geolocation_id"] = get_geolocation_ids(data[ai], data[coi])
 
     facility_data = facility_data.set_index("id")
 
@@ -409,27 +481,131 @@ def get_normalised_data(
     facility_data = facility_data[
         [facility_data.columns[-1]] + list(facility_data.columns[:-1])
     ]
+    facility_data = facility_data.join(get_opening_masks(facility_data))
     column_data = column_data[
-        list(column_data.columns[-2:]) + list(column_data.columns[:-2])
+        [gi, fi] + [c for c in column_data.columns if c not in [gi, fi]]
     ]
 
-    # Annotate
-    # get annotated fields
-    with open(INPUT_METADATA_FILE, "r", encoding="utf-8") as f:
-        annotations = yaml.safe_load(f)
+    # Keep the string forms of the integer keys for compatibility
+    if integer_keys:
+        address_data.insert(0, STRING_ID, get_address_ids(address_data))
+        coordinate_data.insert(0, STRING_ID, get_coordinate_ids(coordinate_data))
+        geolocation_data.insert(
+            0,
+            STRING_ID,
+            get_geolocation_ids(
+                geolocation_data[ai].map(address_data[STRING_ID]),
+                geolocation_data[coi].map(coordinate_data[STRING_ID]),
+            ),
+        )
+        facility_data.insert(
+            0,
+            STRING_ID,
+            get_facility_ids(
+                facility_data["operator_id"],
+                facility_data[gi]
+                .map(geolocation_data[ai])
+                .map(address_data[STRING_ID]),
+            ),
+        )
 
-    # Define data and filenames
-    data_dict = {
+    return {
         "column": column_data,
         "facility": facility_data,
-        "point": point_data,
-        "operator": operator_data,
         "geolocation": geolocation_data,
-        "socket": socket_data,
-        "compatibility": compatibility_data,
         "address": address_data,
         "coordinate": coordinate_data,
     }
+
+
+def run_tasks(tasks, executor: str):
+    """
+    Run (function, arguments) tasks and return their results in the order of the tasks.
+    """
+    if executor == "serial":
+        return [function(*arguments) for function, arguments in tasks]
+    with EXECUTORS[executor](max_workers=MAX_WORKERS) as pool:
+        futures = [pool.submit(function, *arguments) for function, arguments in tasks]
+        return [future.result() for future in futures]
+
+
+def get_normalised_data(
+    filename: str | None = None,
+    download_date: tuple | None = None,
+    integer_keys: bool | None = None,
+    public_keys: bool = False,
+):
+    """
+    Split the cleaned data into its tables and describe them.
+
+    The public key table is only loaded with public_keys, the other tables only
+    hold references to it.
+    """
+    if integer_keys is None:
+        integer_keys = INTEGER_KEYS
+    df, filename, (dd, mm, yyyy) = get_clean_data(filename, download_date)
+
+    df = df.set_index("Ladeeinrichtungs-ID")
+    df.index.name = "id"
+
+    column_data = df.iloc[:, :22].copy()
+
+    ci = "column_id"
+    oi = "operator_id"
+    gi = "geolocation_id"
+    pi = "point_id"
+    si = "socket_id"
+    fi = "facility_id"
+    ai = "address_id"
+    coi = "coordinate_id"
+
+    point_filename = POINT_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    column_filename = COLUMN_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    facility_filename = FACILITY_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    operator_filename = OPERATOR_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    geolocation_filename = GEOLOCATION_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    address_filename = ADDRESS_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    coordinate_filename = COORDINATE_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    socket_filename = SOCKET_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    compatibility_filename = COMPATIBILITY_DATA.format(dd=dd, mm=mm, yyyy=yyyy)
+    key_filename = KEY_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)
+
+    # The operator ids are needed by the facilities, so they are assigned first
+    column_data["Betreiber"] = column_data["Betreiber"].str.strip()
+    if CANONICAL_OPERATORS:
+        # Names with an id keep it, the registry pins the canonical names
+        canonical, _ = get_canonical_operators(
+            column_data["Betreiber"], load_registry("operator")
+        )
+        column_data["Betreiber"] = column_data["Betreiber"].map(canonical)
+    column_data.insert(
+        loc=1, column=oi, value=get_stable_ids(column_data["Betreiber"], "operator")
+    )
+
+    # The tables depend only on the cleaned data, not on each other
+    tables = {}
+    for result in run_tasks(
+        [
+            (get_point_tables, (df,)),
+            (get_operator_table, (column_data[[oi, "Betreiber"]],)),
+            (
+                get_location_tables,
+                (column_data.drop(columns=["Betreiber"]), integer_keys),
+            ),
+        ],
+        TABLE_EXECUTOR,
+    ):
+        tables.update(result)
+    if public_keys:
+        tables["key"] = get_public_keys(dd, mm, yyyy)
+
+    # Annotate
+    # get annotated fields
+    with open(get_metadata_file(), "r", encoding="utf-8") as f:
+        annotations = yaml.safe_load(f)
+
+    # Define data and filenames
+    data_dict = {key: tables[key] for key in TABLES if key in tables}
     filenames = {
         "column": column_filename,
         "facility": facility_filename,
@@ -440,21 +616,20 @@ def get_normalised_data(
         "compatibility": compatibility_filename,
         "address": address_filename,
         "coordinate": coordinate_filename,
+        "key": key_filename,
     }
 
     # Define foreign key mappings
     foreign_key_map = {
         "column": [
-            create_foreign_key([fi], operator_filename, ["id"]),
+            create_foreign_key([fi], facility_filename, ["id"]),
             create_foreign_key([gi], geolocation_filename, ["id"]),
         ],
         "facility": [
             create_foreign_key([oi], operator_filename, ["id"]),
             create_foreign_key([gi], geolocation_filename, ["id"]),
         ],
-        "point": [
-            create_foreign_key([ci], column_filename, ["id"]),
-        ],
+        "point": [create_foreign_key([ci], column_filename, ["id"])],
         "geolocation": [
             create_foreign_key([ai], address_filename, ["id"]),
             create_foreign_key([coi], coordinate_filename, ["id"]),
@@ -464,6 +639,10 @@ def get_normalised_data(
             create_foreign_key([si], socket_filename, ["id"]),
         ],
     }
+    if public_keys:
+        foreign_key_map["point"].append(
+            create_foreign_key([KEY_ID], key_filename, ["id"])
+        )
 
     # Process resources
     resources = process_resources(data_dict, annotations, filenames, foreign_key_map)
@@ -474,6 +653,7 @@ def get_normalised_data(
     annotations_new["title"] = "FAIR Charging Station data (Normalised)"
     annotations_new["description"] = (
         "Normalised dataset based on the BNetzA charging station data."
+        + describe_subset()
     )
     annotations_new["publicationDate"] = f"{yyyy}-{mm}-{dd}"
     annotations_new["resources"] = resources
@@ -482,24 +662,27 @@ def get_normalised_data(
 
 
 def main():
-    data, filenames, annotations_new, (dd, mm, yyyy) = get_normalised_data()
+    data, filenames, annotations_new, (dd, mm, yyyy) = get_normalised_data(
+        public_keys=True
+    )
     # export
-
-    if not path.exists(f"{NORMALISEDIR}"):
-        mkdir(NORMALISEDIR)
+    output_dir = get_output_dir(NORMALISEDIR)
+    if not path.exists(output_dir):
+        makedirs(output_dir)
 
     for element in data.keys():
-        data[element].to_csv(
-            f"{NORMALISEDIR}/{filenames[element]}.csv",
-            date_format="%Y-%m-%d %H:%M:%S",
+        write_csv(
+            data[element],
+            f"{output_dir}/{filenames[element]}.csv",
+            date_format=DATETIME_FORMAT,
         )
 
-    with open(
-        f"{NORMALISEDIR}/{NORMALIZED_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json",
-        "w",
-        encoding="utf8",
-    ) as output:
-        json.dump(annotations_new, output, indent=4, ensure_ascii=False)
+    write_json(
+        annotations_new,
+        f"{output_dir}/{NORMALIZED_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json",
+        indent=4,
+        ensure_ascii=False,
+    )
 
 
 if __name__ == "__main__":
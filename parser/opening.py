@@ -0,0 +1,192 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+import re
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+OPENING_COLUMNS = [
+    "Öffnungszeiten",
+    "Öffnungszeiten: Wochentage",
+    "Öffnungszeiten: Tageszeiten",
+]
+# A week has 168 hourly slots, slot = weekday * 24 + hour with monday as 0.
+# They are split over three 56 bit words so every word fits in an int64 column.
+SLOTS = 168
+WORD_SLOTS = 56
+MASK_COLUMNS = ["opening_mask_0", "opening_mask_1", "opening_mask_2"]
+STATE_COLUMN = "opening_state"
+
+OPENING_ANNOTATIONS = {
+    **{
+        column: {
+            "description": f"Opening hours of week slots {WORD_SLOTS * w} to {WORD_SLOTS * (w + 1) - 1} as bitmask, slot = weekday * 24 + hour with monday as 0."
+        }
+        for w, column in enumerate(MASK_COLUMNS)
+    },
+    STATE_COLUMN: {
+        "description": "Whether the facility is always open, open as scheduled in the opening masks or the opening hours are unknown."
+    },
+}
+
+ALWAYS = "always"
+SCHEDULED = "scheduled"
+UNKNOWN = "unknown"
+ALWAYS_OPEN = ["247", "24/7"]
+
+DAYS = {
+    "mo": 0,
+    "montag": 0,
+    "di": 1,
+    "dienstag": 1,
+    "mi": 2,
+    "mittwoch": 2,
+    "do": 3,
+    "donnerstag": 3,
+    "fr": 4,
+    "freitag": 4,
+    "sa": 5,
+    "samstag": 5,
+    "so": 6,
+    "sonntag": 6,
+}
+DAY_GROUPS = {
+    "täglich": range(7),
+    "werktags": range(6),
+    "wochentags": range(5),
+    "wochenende": range(5, 7),
+}
+DAY_SEPARATORS = re.compile(r"\s*(?:,|/|\bund\b|&)\s*|\s+")
+DAY_RANGE = re.compile(r"\s*(?:-|–|\bbis\b)\s*")
+HOUR_RANGE = re.compile(
+    r"(\d{1,2})(?:[:.](\d{2}))?\s*(?:uhr)?\s*(?:-|–|bis)\s*(\d{1,2})(?:[:.](\d{2}))?"
+)
+FULL_DAY = ["24h", "24 h", "24 stunden", "durchgehend", "ganztägig"]
+
+
+def parse_days(text):
+    """Return the weekdays of a day group like "Mo-Fr" or "Sa, So", None if unknown."""
+    text = DAY_RANGE.sub("-", text.strip().lower().rstrip("."))
+    days = set()
+    for token in DAY_SEPARATORS.split(text):
+        token = token.strip(".:")
+        if not token:
+            continue
+        if token in DAY_GROUPS:
+            days.update(DAY_GROUPS[token])
+        elif "-" in token:
+            start, _, end = token.partition("-")
+            if start.strip(".") not in DAYS or end.strip(".") not in DAYS:
+                return None
+            start, end = DAYS[start.strip(".")], DAYS[end.strip(".")]
+            # Ranges like Fr-Mo wrap around the end of the week
+            days.update(range(start, end + 1 if start <= end else end + 8))
+        elif token in DAYS:
+            days.add(DAYS[token])
+        else:
+            return None
+    return set(d % 7 for d in days) or None
+
+
+def parse_hours(text):
+    """
+    Return the (start, end) hours of an hour group like "08:00-18:00", None if unknown.
+
+    The masks have hourly slots, a slot counts as open if the facility is open
+    during any part of it. A start like 07:30 opens the slot of 7, an end like
+    18:30 keeps the slot of 18 open.
+    """
+    text = text.strip().lower()
+    if any(full in text for full in FULL_DAY):
+        return [(0, 24)]
+    hours = []
+    # The start minutes fall into the slot of their hour
+    for start_h, _, end_h, end_m in HOUR_RANGE.findall(text):
+        start = int(start_h)
+        end = int(end_h) + (1 if end_m and int(end_m) > 0 else 0)
+        # Closing at midnight
+        if end == 0:
+            end = 24
+        if start > 23 or end > 24:
+            return None
+        hours.append((start, end))
+    return hours or None
+
+
+def get_mask(days_text, hours_text):
+    """Compile the weekday and hour texts of a facility into a 168 bit mask, None if unknown."""
+    if not isinstance(days_text, str) or not isinstance(hours_text, str):
+        return None
+    day_groups = [d for d in days_text.split(";") if d.strip()]
+    hour_groups = [h for h in hours_text.split(";") if h.strip()]
+    if not day_groups or not hour_groups:
+        return None
+    if len(day_groups) == len(hour_groups):
+        pairs = zip(day_groups, hour_groups)
+    elif len(hour_groups) == 1:
+        pairs = [(d, hour_groups[0]) for d in day_groups]
+    elif len(day_groups) == 1:
+        pairs = [(day_groups[0], ";".join(hour_groups))]
+    else:
+        return None
+
+    mask = 0
+    for day_text, hour_text in pairs:
+        days = parse_days(day_text)
+        hours = parse_hours(hour_text)
+        if days is None or hours is None:
+            return None
+        for day in days:
+            for start, end in hours:
+                # Opening hours past midnight continue on the next day
+                if end <= start:
+                    end += 24
+                for hour in range(start, end):
+                    mask |= 1 << ((day * 24 + hour) % SLOTS)
+    return mask
+
+
+def get_opening_masks(data):
+    """
+    Encode the opening hours of a table into weekly bitmasks.
+
+    Only the distinct combinations of the opening hour texts are parsed, the
+    result is mapped back to all rows.
+    """
+    texts = data[OPENING_COLUMNS].astype("string").fillna("")
+    combinations = texts.drop_duplicates().reset_index(drop=True)
+    masks = []
+    states = []
+    for opening, days_text, hours_text in combinations.itertuples(index=False):
+        mask = get_mask(days_text, hours_text)
+        if opening in ALWAYS_OPEN:
+            mask, state = (1 << SLOTS) - 1, ALWAYS
+        elif mask is None or opening in ["", "Keine Angabe"]:
+            mask, state = 0, UNKNOWN
+        else:
+            state = SCHEDULED
+        masks.append(
+            [(mask >> (WORD_SLOTS * w)) & ((1 << WORD_SLOTS) - 1) for w in range(3)]
+        )
+        states.append(state)
+    combinations[MASK_COLUMNS] = pd.DataFrame(masks, dtype="int64")
+    combinations[STATE_COLUMN] = states
+
+    encoded = texts.merge(combinations, on=OPENING_COLUMNS, how="left")
+    encoded.index = data.index
+    return encoded[MASK_COLUMNS + [STATE_COLUMN]]
+
+
+def is_open(data, when):
+    """
+    Return for every row whether it is open at the given time.
+
+    Rows with unknown opening hours are missing values instead of False.
+    """
+    when = pd.Timestamp(when)
+    word, bit = divmod(when.weekday() * 24 + when.hour, WORD_SLOTS)
+    mask = data[MASK_COLUMNS[word]].to_numpy(dtype="int64")
+    result = pd.array((mask >> bit) & 1 == 1, dtype="boolean")
+    result[(data[STATE_COLUMN] == UNKNOWN).to_numpy()] = pd.NA
+    return pd.Series(result, index=data.index)
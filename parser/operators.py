@@ -0,0 +1,201 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Canonicalise the operator names.
+
+Names are normalised by removing legal forms, punctuation, case and spacing, names
+with the same normalised key are merged. Keys sharing a rare token are compared by
+similarity, so common tokens like "Stadtwerke" never make every pair a candidate,
+and similar keys are merged as well. Every group of names is replaced by its most
+frequent name, unless a name of the group has an id in the operator registry:
+then the first registered name stays the canonical one, so the group keeps its
+id when the frequencies of the names change.
+"""
+
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from itertools import combinations
+from .clean import get_clean_data
+from .output import write_csv
+from .registry import load_registry
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+REPORTDIR = "reports"
+REPORT_FILENAME = "operators_{dd}_{mm}_{yyyy}.csv"
+
+TRANSLITERATION = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+PUNCTUATION = re.compile(r"[^\w\s]|_")
+# Spelled out legal forms are replaced by their abbreviation first
+LEGAL_FORM_PHRASES = {
+    re.compile(r"gesellschaft mit beschraenkter haftung"): "gmbh",
+    re.compile(r"kommanditgesellschaft auf aktien"): "kgaa",
+    re.compile(r"\b\w*aktiengesellschaft\b"): "ag",
+    re.compile(r"\bkommanditgesellschaft\b"): "kg",
+    re.compile(r"\beingetragener verein\b"): "ev",
+    re.compile(r"\beingetragene genossenschaft\b"): "eg",
+}
+LEGAL_FORMS = {
+    "ag",
+    "and",
+    "bv",
+    "co",
+    "eg",
+    "ek",
+    "ev",
+    "gbr",
+    "gmbh",
+    "haftungsbeschraenkt",
+    "inc",
+    "kg",
+    "kgaa",
+    "llc",
+    "ltd",
+    "mbh",
+    "nv",
+    "ohg",
+    "plc",
+    "sa",
+    "sarl",
+    "se",
+    "ug",
+    "und",
+}
+# Tokens of more keys are too common to find candidates
+MAX_BLOCK_SIZE = 100
+SIMILARITY_THRESHOLD = 0.94
+
+
+def get_tokens(name: str):
+    """Return the tokens of an operator name without legal forms and punctuation."""
+    text = unicodedata.normalize("NFKC", name).casefold().translate(TRANSLITERATION)
+    text = PUNCTUATION.sub(" ", text)
+    for phrase, abbreviation in LEGAL_FORM_PHRASES.items():
+        text = phrase.sub(abbreviation, text)
+    # Abbreviations like e.V. or E.ON were split into single letters
+    tokens = []
+    for token in text.split():
+        if len(token) == 1 and tokens and tokens[-1].isalpha() and len(tokens[-1]) < 3:
+            tokens[-1] += token
+        else:
+            tokens.append(token)
+    return [t for t in tokens if t not in LEGAL_FORMS] or tokens
+
+
+def get_candidates(keys: dict):
+    """
+    Return the pairs of keys sharing a token that at most MAX_BLOCK_SIZE keys have.
+
+    keys maps every key to its tokens.
+    """
+    blocks = defaultdict(list)
+    for key, tokens in keys.items():
+        for token in set(tokens):
+            blocks[token].append(key)
+    candidates = set()
+    for block in blocks.values():
+        if len(block) <= MAX_BLOCK_SIZE:
+            candidates.update(combinations(sorted(block), 2))
+    return candidates
+
+
+def get_similar_pairs(candidates):
+    """Yield the candidate pairs of keys with a similarity above the threshold."""
+    # The matcher indexes its second sequence, so every key is indexed once
+    others = defaultdict(list)
+    for a, b in candidates:
+        others[b].append(a)
+    matcher = SequenceMatcher(None, autojunk=False)
+    for b, keys in others.items():
+        matcher.set_seq2(b)
+        for a in keys:
+            # The ratio is at most twice the shorter length by the total length
+            if 2 * min(len(a), len(b)) < SIMILARITY_THRESHOLD * (len(a) + len(b)):
+                continue
+            matcher.set_seq1(a)
+            if (
+                matcher.quick_ratio() >= SIMILARITY_THRESHOLD
+                and matcher.ratio() >= SIMILARITY_THRESHOLD
+            ):
+                yield a, b
+
+
+def find(parents: dict, key: str):
+    """Return the root of a key in the union-find forest."""
+    while parents[key] != key:
+        parents[key] = parents[parents[key]]
+        key = parents[key]
+    return key
+
+
+def get_canonical_operators(names, registry: dict | None = None):
+    """
+    Find the canonical name of every operator name.
+
+    registry maps the names registered before to their ids, see
+    registry.load_registry. Returns a series from name to canonical name and the
+    audit table of all names with their key, number of columns and the rule they
+    were merged by.
+    """
+    counts = names.dropna().value_counts()
+    audit = pd.DataFrame({"name": counts.index, "columns": counts.to_numpy()})
+    tokens = [get_tokens(name) for name in audit["name"]]
+    # Keys ignore the spacing between tokens
+    audit["key"] = ["".join(t) for t in tokens]
+    keys = dict(zip(audit["key"], tokens))
+
+    parents = {key: key for key in keys}
+    for a, b in get_similar_pairs(get_candidates(keys)):
+        parents[find(parents, a)] = find(parents, b)
+    audit["group"] = [find(parents, key) for key in audit["key"]]
+
+    # The first registered name of a group is its canonical name, otherwise the
+    # most frequent one, ties are broken by the shorter and then the
+    # alphabetically first name
+    audit["registered"] = audit["name"].map(registry or {})
+    audit["length"] = audit["name"].str.len()
+    audit = audit.sort_values(
+        ["group", "registered", "columns", "length", "name"],
+        ascending=[True, True, False, True, True],
+        na_position="last",
+    )
+    first = audit.groupby("group").head(1).set_index("group")
+    audit["canonical"] = audit["group"].map(first["name"])
+    canonical_keys = audit["group"].map(first["key"])
+
+    audit["rule"] = "similar"
+    audit.loc[audit["key"] == canonical_keys, "rule"] = "normalised"
+    audit.loc[audit["name"] == audit["canonical"], "rule"] = "canonical"
+    audit["similarity"] = [
+        round(SequenceMatcher(None, a, b, autojunk=False).ratio(), 4)
+        if rule == "similar"
+        else 1.0
+        for a, b, rule in zip(audit["key"], canonical_keys, audit["rule"])
+    ]
+    audit = audit[["canonical", "name", "key", "columns", "rule", "similarity"]]
+    audit = audit.sort_values(["canonical", "rule", "name"]).reset_index(drop=True)
+    return audit.set_index("name")["canonical"], audit
+
+
+def main():
+    df, _, (dd, mm, yyyy) = get_clean_data()
+    names = df["Betreiber"].str.strip()
+    canonical, audit = get_canonical_operators(names, load_registry("operator"))
+
+    write_csv(
+        audit,
+        f"{get_output_dir(REPORTDIR)}/{REPORT_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}",
+        index=False,
+    )
+    print(f"{canonical.nunique()} canonical operators of {len(canonical)} names")
+    for rule, count in audit["rule"].value_counts().items():
+        print(f"{count} names are {rule}")
+
+
+if __name__ == "__main__":
+    main()
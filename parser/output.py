@@ -0,0 +1,184 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from .dates import format_date_columns
+
+MANIFEST_FILENAME = "SHA256SUMS"
+TEMP_FILENAME = ".{name}.{pid}.{thread}.tmp"
+
+# Guards the manifests, so concurrent writers to a directory keep all entries
+MANIFEST_LOCK = threading.RLock()
+# Manifests by directory while they are batched, written when the batch ends
+batched_manifests = None
+
+
+class HashingWriter:
+    """Text file wrapper that hashes the encoded content while writing it."""
+
+    def __init__(self, file, encoding: str = "utf-8"):
+        self.file = file
+        self.encoding = encoding
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.changed = None
+
+    def write(self, text):
+        data = text.encode(self.encoding)
+        self.hash.update(data)
+        self.size += len(data)
+        self.file.write(data)
+        return len(text)
+
+
+def read_manifest(directory):
+    """Read the manifest of a directory as a dictionary from file name to SHA256 digest."""
+    manifest_path = Path(directory).joinpath(MANIFEST_FILENAME)
+    if not manifest_path.exists():
+        return {}
+    manifest = {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            digest, _, name = line.rstrip("\n").partition("  ")
+            if name:
+                manifest[name] = digest
+    return manifest
+
+
+def write_manifest(directory, manifest: dict):
+    """Write the manifest of a directory in the format of sha256sum."""
+    manifest_path = Path(directory).joinpath(MANIFEST_FILENAME)
+    if not manifest:
+        # sha256sum rejects an empty manifest
+        manifest_path.unlink(missing_ok=True)
+        return
+    temp_path = get_temp_path(manifest_path)
+    with open(temp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.writelines(f"{manifest[name]}  {name}\n" for name in sorted(manifest))
+    os.replace(temp_path, manifest_path)
+
+
+def get_temp_path(file_path: Path):
+    """Return a temporary path next to a file, unique per process and thread."""
+    return file_path.with_name(
+        TEMP_FILENAME.format(
+            name=file_path.name, pid=os.getpid(), thread=threading.get_ident()
+        )
+    )
+
+
+def get_manifest(directory):
+    """Return the manifest of a directory, the batched one during a batch."""
+    if batched_manifests is None:
+        return read_manifest(directory)
+    key = Path(directory)
+    if key not in batched_manifests:
+        batched_manifests[key] = read_manifest(directory)
+    return batched_manifests[key]
+
+
+def set_manifest(directory, manifest: dict):
+    """Write the manifest of a directory, or keep it until the batch ends."""
+    if batched_manifests is None:
+        write_manifest(directory, manifest)
+
+
+@contextmanager
+def batch_manifests():
+    """
+    Write the manifests of the files written in the block once per directory.
+
+    Without a batch every file rewrites the manifest of its directory, which is
+    quadratic for directories with many files.
+    """
+    global batched_manifests
+    with MANIFEST_LOCK:
+        # Nested batches are part of the outer one
+        nested = batched_manifests is not None
+        if not nested:
+            batched_manifests = {}
+    if nested:
+        yield
+        return
+    try:
+        yield
+    finally:
+        with MANIFEST_LOCK:
+            manifests, batched_manifests = batched_manifests, None
+            for directory, manifest in manifests.items():
+                write_manifest(directory, manifest)
+
+
+def remove_output(file_path):
+    """Remove a written file and its entry of the manifest."""
+    file_path = Path(file_path)
+    with MANIFEST_LOCK:
+        file_path.unlink(missing_ok=True)
+        manifest = get_manifest(file_path.parent)
+        if manifest.pop(file_path.name, None) is not None:
+            set_manifest(file_path.parent, manifest)
+
+
+@contextmanager
+def open_output(file_path, encoding: str = "utf-8"):
+    """
+    Open a text file for writing that is only replaced if its content changed.
+
+    The content is written to a temporary file in the same directory and hashed
+    on the way. If the hash and size match the manifest of the previous run the
+    existing file is kept untouched, otherwise it is replaced and the manifest is
+    updated. After the block, the writer tells whether the file changed.
+    """
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = get_temp_path(file_path)
+    try:
+        with open(temp_path, "wb") as f:
+            writer = HashingWriter(f, encoding)
+            yield writer
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    digest = writer.hash.hexdigest()
+    with MANIFEST_LOCK:
+        manifest = get_manifest(file_path.parent)
+        writer.changed = not (
+            manifest.get(file_path.name) == digest
+            and file_path.exists()
+            and file_path.stat().st_size == writer.size
+        )
+        if writer.changed:
+            os.replace(temp_path, file_path)
+            manifest[file_path.name] = digest
+            set_manifest(file_path.parent, manifest)
+        else:
+            temp_path.unlink()
+
+
+def write_csv(
+    data, file_path, encoding: str = "utf-8", date_format: str | None = None, **kwargs
+):
+    """
+    Write a frame as CSV, return whether the file changed.
+
+    Datetime columns are formatted with date_format before the frame is written,
+    once for every distinct date.
+    """
+    if date_format is not None:
+        data = format_date_columns(data, date_format)
+    with open_output(file_path, encoding) as output:
+        data.to_csv(output, **kwargs)
+    return output.changed
+
+
+def write_json(obj, file_path, encoding: str = "utf-8", **kwargs):
+    """Write an object as JSON, return whether the file changed."""
+    with open_output(file_path, encoding) as output:
+        json.dump(obj, output, **kwargs)
+    return output.changed
@@ -0,0 +1,211 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Write the flat and normalised tables partitioned by federal state.
+
+Every federal state gets a hive-style directory federal_state=<state>/ with its
+rows of every table and an index of the row counts and the bounding box. The
+operators, sockets and public keys are shared by all states and written once,
+the flat dataset references the same key table.
+The resources of the frictionless metadata list the partitions as multipart
+paths, every part repeats the header.
+"""
+
+from pathlib import Path
+from .output import batch_manifests, write_csv, write_json
+from .dates import DATETIME_FORMAT
+from .rename import (
+    BUNDLE_DIRNAME,
+    OEP,
+    OEP_NORMAL_FILENAME,
+    OEP_REGULAR_FILEANAME,
+    get_renamed_annotated,
+    get_renamed_normalised,
+)
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+PARTITIONDIR = "partitioned"
+PARTITION_COLUMN = "federal_state"
+PARTITION_DIRNAME = "federal_state={state}"
+# Rows without federal state, named as by hive
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+INDEX_FILENAME = "index.json"
+
+# The federal state of a row is the one of the row it references, in the order
+# the states are resolved
+PARTITION_REFERENCES = {
+    "geolocation": ("address_id", "address"),
+    "facility": ("geolocation_id", "geolocation"),
+    "column": ("geolocation_id", "geolocation"),
+    "point": ("column_id", "column"),
+    "compatibility": ("point_id", "point"),
+}
+# or the one of the first row referencing it
+PARTITION_REFERRERS = {"coordinate": ("geolocation", "coordinate_id")}
+
+
+def get_partition_states(data):
+    """Return the federal state of every row of the partitioned normalised tables."""
+    states = {"address": data["address"][PARTITION_COLUMN].fillna(DEFAULT_PARTITION)}
+    for table, (column, parent) in PARTITION_REFERENCES.items():
+        states[table] = (
+            data[table][column].map(states[parent]).fillna(DEFAULT_PARTITION)
+        )
+    for table, (referrer, column) in PARTITION_REFERRERS.items():
+        referrer_states = pd.Series(
+            states[referrer].to_numpy(), index=data[referrer][column].to_numpy()
+        )
+        referrer_states = referrer_states[~referrer_states.index.duplicated()]
+        states[table] = (
+            data[table].index.to_series().map(referrer_states).fillna(DEFAULT_PARTITION)
+        )
+    return states
+
+
+def get_partition_path(state: str, filename: str):
+    """Return the path of a partition relative to the partitioned directory."""
+    return f"{PARTITION_DIRNAME.format(state=state)}/{filename}.csv"
+
+
+def write_partitions(df, states, directory, filename: str, rows: dict, **kwargs):
+    """
+    Write a table partitioned by the federal states of its rows.
+
+    Adds the row counts of the partitions to rows, returns their paths.
+    """
+    paths = []
+    for state, part in df.groupby(states.to_numpy(), sort=True):
+        path = get_partition_path(state, filename)
+        write_csv(part, Path(directory).joinpath(path), **kwargs)
+        rows.setdefault(state, {})[filename] = len(part)
+        paths.append(path)
+    return paths
+
+
+def get_bounding_boxes(station_data, states):
+    """Return the bounding box of every federal state as [west, south, east, north]."""
+    bounds = station_data.groupby(states.to_numpy())[["longitude", "latitude"]].agg(
+        ["min", "max"]
+    )
+    return {
+        state: [
+            b[("longitude", "min")],
+            b[("latitude", "min")],
+            b[("longitude", "max")],
+            b[("latitude", "max")],
+        ]
+        for state, b in bounds.astype(float).round(6).iterrows()
+    }
+
+
+def set_partition_paths(resources, paths: dict):
+    """Replace the paths of the partitioned resources by the paths of their parts."""
+    for resource in resources:
+        if resource["path"] in paths:
+            resource["path"] = paths[resource["path"]]
+
+
+def write_partitioned_bnetza(
+    output_path: str,
+    filename: str | None = None,
+    download_date: tuple | None = None,
+):
+    data, filenames, normalised_metadata, (dd, mm, yyyy) = get_renamed_normalised(
+        filename=filename, download_date=download_date, oep=OEP
+    )
+    station_data, station_filename, station_metadata, _ = get_renamed_annotated(
+        filename=filename, download_date=download_date, oep=OEP
+    )
+    output_name = Path(get_output_dir(output_path)).joinpath(
+        BUNDLE_DIRNAME.format(yyyy=yyyy, mm=mm, dd=dd)
+    )
+
+    rows = {}
+    paths = {}
+    states = get_partition_states(data)
+    for element in data:
+        if element in states:
+            paths[f"{filenames[element]}.csv"] = write_partitions(
+                data[element],
+                states[element],
+                output_name,
+                filenames[element],
+                rows,
+                date_format=DATETIME_FORMAT,
+            )
+        else:
+            write_csv(
+                data[element],
+                output_name.joinpath(f"{filenames[element]}.csv"),
+                date_format=DATETIME_FORMAT,
+            )
+
+    station_states = station_data[PARTITION_COLUMN].fillna(DEFAULT_PARTITION)
+    paths[f"{station_filename}.csv"] = write_partitions(
+        station_data,
+        station_states,
+        output_name,
+        station_filename,
+        rows,
+        index=OEP,
+        date_format=DATETIME_FORMAT,
+    )
+
+    set_partition_paths(normalised_metadata["resources"], paths)
+    set_partition_paths(station_metadata["resources"], paths)
+    for metadata in [normalised_metadata, station_metadata]:
+        metadata["description"] += f" Partitioned by {PARTITION_COLUMN}."
+    write_json(
+        normalised_metadata,
+        output_name.joinpath(
+            f"{OEP_NORMAL_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
+        ),
+        indent=4,
+        ensure_ascii=False,
+    )
+    write_json(
+        station_metadata,
+        output_name.joinpath(
+            f"{OEP_REGULAR_FILEANAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
+        ),
+        indent=4,
+        ensure_ascii=False,
+    )
+
+    # Readers pick the partitions they need from the index
+    bounding_boxes = get_bounding_boxes(station_data, station_states)
+    index = [
+        {
+            PARTITION_COLUMN: state,
+            "path": PARTITION_DIRNAME.format(state=state),
+            "rows": rows[state],
+            "bbox": bounding_boxes.get(state),
+        }
+        for state in sorted(rows)
+    ]
+    for partition in index:
+        write_json(
+            partition,
+            output_name.joinpath(partition["path"], INDEX_FILENAME),
+            indent=4,
+            ensure_ascii=False,
+        )
+    write_json(
+        index, output_name.joinpath(INDEX_FILENAME), indent=4, ensure_ascii=False
+    )
+    return index
+
+
+def main():
+    with batch_manifests():
+        index = write_partitioned_bnetza(PARTITIONDIR)
+    for partition in index:
+        print(f"{partition[PARTITION_COLUMN]:40} {sum(partition['rows'].values()):8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+from .clean import get_clean_data
+from .output import write_csv
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+REPORTDIR = "reports"
+REPORT_FILENAME = "coordinate_plausibility_{filename}.csv"
+
+EARTH_RADIUS = 6371.0088  # km
+LATITUDE_BOUNDS = (47.2, 55.1)
+LONGITUDE_BOUNDS = (5.8, 15.1)
+
+# Centroids of groups with fewer members are not trusted
+MIN_GROUP_SIZE = 3
+# Distance to the centroid in km above which a column is an outlier
+CENTROID_TOLERANCE = {
+    "postcode": ("Postleitzahl", 20),
+    "county": ("Kreis/kreisfreie Stadt", 60),
+}
+# Flags that block a release, the other flags are only reported
+BLOCKING_FLAGS = ["outside_germany", "probable_swap"]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in km between arrays of coordinates in degrees."""
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2)
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def in_germany(lat, lon):
+    """Whether coordinates lie within the bounding box of Germany."""
+    return lat.between(*LATITUDE_BOUNDS) & lon.between(*LONGITUDE_BOUNDS)
+
+
+def get_centroids(coordinates, group):
+    """Median coordinate of every group with enough members."""
+    grouped = coordinates.groupby(group)[["lat", "lon"]]
+    sizes = grouped.size()
+    return grouped.median()[sizes >= MIN_GROUP_SIZE]
+
+
+def get_plausibility(df):
+    """
+    Check the coordinates of every column against the centroids of its
+    postcode and county.
+
+    Returns the flagged columns with their distances to the centroids.
+    """
+    coordinates = pd.DataFrame(
+        {
+            "Ladeeinrichtungs-ID": df["Ladeeinrichtungs-ID"],
+            "Postleitzahl": df["Postleitzahl"].astype(str),
+            "Kreis/kreisfreie Stadt": df["Kreis/kreisfreie Stadt"],
+            "lat": pd.to_numeric(df["Breitengrad"], errors="coerce"),
+            "lon": pd.to_numeric(df["Längengrad"], errors="coerce"),
+        }
+    )
+    flags = pd.DataFrame(index=coordinates.index)
+    flags["missing"] = coordinates[["lat", "lon"]].isna().any(axis=1)
+    flags["outside_germany"] = ~flags["missing"] & ~in_germany(
+        coordinates["lat"], coordinates["lon"]
+    )
+    swap_plausible = in_germany(coordinates["lon"], coordinates["lat"])
+
+    # Only plausible coordinates contribute to the centroids
+    valid = coordinates[~flags["missing"] & ~flags["outside_germany"]]
+    swap_close = pd.Series(False, index=coordinates.index)
+    for name, (group, tolerance) in CENTROID_TOLERANCE.items():
+        centroids = get_centroids(valid, group)
+        centroid = coordinates[[group]].join(centroids, on=group)
+        distance = haversine(
+            coordinates["lat"], coordinates["lon"], centroid["lat"], centroid["lon"]
+        )
+        swapped_distance = haversine(
+            coordinates["lon"], coordinates["lat"], centroid["lat"], centroid["lon"]
+        )
+        coordinates[f"{name}_distance"] = distance.round(3)
+        flags[f"{name}_outlier"] = distance > tolerance
+        swap_close |= swapped_distance <= tolerance
+
+    flags["probable_swap"] = (
+        (flags["outside_germany"] | flags["postcode_outlier"] | flags["county_outlier"])
+        & swap_plausible
+        & swap_close
+    )
+    flagged = flags.any(axis=1)
+    return coordinates[flagged].join(flags[flagged])
+
+
+def main():
+    df, filename, (_, _, _) = get_clean_data()
+    report = get_plausibility(df)
+
+    write_csv(
+        report,
+        f"{get_output_dir(REPORTDIR)}/{REPORT_FILENAME.format(filename=filename)}",
+        index=False,
+    )
+    counts = report[[c for c in report.columns if report[c].dtype == bool]].sum()
+    print(counts.to_string())
+
+    assert not report[BLOCKING_FLAGS].any(axis=None), (
+        f"The coordinates of {report[BLOCKING_FLAGS].any(axis=1).sum()} columns are implausible"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,9 @@ from random import randint
 from getpass import getpass
 from os import environ
 from .rename import get_renamed_annotated
+from .clean import get_public_keys
+from .keys import restore_keys
+from .dates import DATE_FORMAT, format_dates
 import requests as req
 from oep_client import OepClient
 from json import loads, dumps
@@ -24,6 +27,22 @@ station_data, station_filename, station_compiled_metadata, (dd, mm, yyyy) = (
     get_renamed_annotated(download_date=(1, 10, 2023))
 )
 table = station_filename
+# The published table holds the public keys, the references only hold in a snapshot
+key_id_columns = [f"charger_public_key_id_{n}" for n in range(1, 7)]
+key_columns = [f"charger_public_key_{n}" for n in range(1, 7)]
+station_data = restore_keys(
+    station_data,
+    get_public_keys(dd, mm, yyyy),
+    id_columns=key_id_columns,
+    key_columns=key_columns,
+)
+station_resource = station_compiled_metadata["resources"][0]
+for field in station_resource["schema"]["fields"]:
+    if field["name"] in key_id_columns:
+        field["name"] = key_columns[key_id_columns.index(field["name"])]
+        field["description"] = "Public key of the charging point."
+        field["type"] = "string"
+station_compiled_metadata["resources"] = [station_resource]
 # %%
 table_schema = {
     "columns": [
@@ -58,6 +77,12 @@ table_schema = {
         {"name": "charger_type_4", "data_type": "varchar(80)"},
         {"name": "charger_power_4", "data_type": "float(14)"},
         {"name": "charger_public_key_4", "data_type": "text"},
+        {"name": "charger_type_5", "data_type": "varchar(80)"},
+        {"name": "charger_power_5", "data_type": "float(14)"},
+        {"name": "charger_public_key_5", "data_type": "text"},
+        {"name": "charger_type_6", "data_type": "varchar(80)"},
+        {"name": "charger_power_6", "data_type": "float(14)"},
+        {"name": "charger_public_key_6", "data_type": "text"},
     ]
 }
 # %%
@@ -96,8 +121,8 @@ my_list = [
     "charger_public_key_6",
 ]
 # %%
-station_data["commissioning_date"] = station_data["commissioning_date"].dt.strftime(
-    "%Y-%m-%d"
+station_data["commissioning_date"] = format_dates(
+    station_data["commissioning_date"], DATE_FORMAT
 )
 station_data = station_data.where(pd.notnull(station_data), None)
 station_data["charger_power_2"] = station_data["charger_power_2"].replace(np.nan, None)
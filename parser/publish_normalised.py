@@ -0,0 +1,170 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+import asyncio
+from copy import deepcopy
+from getpass import getpass
+from os import environ
+from .rename import get_renamed_normalised
+from .dates import DATE_FORMAT, format_date_columns
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+req = lazy_import("requests")
+
+OEP_URL = environ.get("OEP_URL", "https://openenergyplatform.org")
+TOPIC = "model_draft"
+TABLE_URL = "{url}/api/v0/schema/{topic}/tables/{table}"
+
+CHUNK_SIZE = 1000
+MAX_CONNECTIONS = 8
+
+OEP_DATATYPE = {
+    "integer": "bigint",
+    "number": "float",
+    "float": "float",
+    "boolean": "boolean",
+    "date": "date",
+    "datetime": "timestamp",
+    "string": "text",
+}
+
+
+def get_table_name(resource_name):
+    """Strip the schema prefix of OEP resource names."""
+    return resource_name.split(".")[-1]
+
+
+def get_upload_levels(metadata):
+    """
+    Group the resources in levels that can be uploaded at the same time.
+
+    A resource is placed in the first level after all the resources its
+    foreign keys refer to, so referenced tables always exist before their rows are referenced.
+    """
+    resources = [r["name"] for r in metadata["resources"]]
+    dependencies = {
+        r["name"]: set(
+            fk["reference"]["resource"]
+            for fk in r["schema"].get("foreignKeys", [])
+            if fk["reference"]["resource"] in resources
+            and fk["reference"]["resource"] != r["name"]
+        )
+        for r in metadata["resources"]
+    }
+    levels = []
+    uploaded = set()
+    while len(uploaded) < len(resources):
+        level = [
+            name
+            for name in resources
+            if name not in uploaded and dependencies[name] <= uploaded
+        ]
+        if not level:
+            raise ValueError(
+                f"The foreign keys of {set(resources) - uploaded} are circular."
+            )
+        levels.append(level)
+        uploaded.update(level)
+    return levels
+
+
+def get_table_schema(resource):
+    """Translate a frictionless resource schema into an OEP table definition."""
+    primary_key = resource["schema"].get("primaryKey", [])
+    columns = []
+    for field in resource["schema"]["fields"]:
+        column = {
+            "name": field["name"],
+            "data_type": OEP_DATATYPE.get(field.get("type", "string"), "text"),
+        }
+        if field["name"] in primary_key:
+            column["primary_key"] = True
+        columns.append(column)
+    return {"columns": columns}
+
+
+def get_records(data):
+    """Convert a table into JSON serialisable rows."""
+    data = data.reset_index()
+    data = format_date_columns(data, DATE_FORMAT)
+    data = data.astype(object).where(data.notna(), None)
+    return data.to_dict(orient="records")
+
+
+def get_session(token: str, max_connections: int = MAX_CONNECTIONS):
+    """Create a session whose connection pool is shared by all uploads."""
+    session = req.Session()
+    adapter = req.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Authorization": f"Token {token}"})
+    return session
+
+
+def send(session, method, url, payload):
+    """Send a JSON request and raise on HTTP errors."""
+    response = session.request(method, url, json=payload)
+    response.raise_for_status()
+    return response
+
+
+async def upload_table(session, limit, url, table, schema, records, metadata):
+    """Create a table, insert its rows in chunks and set its metadata."""
+    table_url = TABLE_URL.format(url=url, topic=TOPIC, table=table)
+    async with limit:
+        await asyncio.to_thread(
+            send, session, "put", f"{table_url}/", {"query": schema}
+        )
+    total = len(records)
+    for start in range(0, total, CHUNK_SIZE):
+        async with limit:
+            await asyncio.to_thread(
+                send,
+                session,
+                "post",
+                f"{table_url}/rows/new",
+                {"query": records[start : start + CHUNK_SIZE]},
+            )
+        print(f"{table}: {min(start + CHUNK_SIZE, total)}/{total} rows uploaded")
+    async with limit:
+        await asyncio.to_thread(send, session, "post", f"{table_url}/meta/", metadata)
+    print(f"{table}: done")
+
+
+async def publish_normalised(data, filenames, metadata, token: str, url: str = OEP_URL):
+    """Upload all normalised tables, level by level in foreign key order."""
+    keys = {filename: key for key, filename in filenames.items()}
+    resources = {r["name"]: r for r in metadata["resources"]}
+    limit = asyncio.Semaphore(MAX_CONNECTIONS)
+    with get_session(token) as session:
+        for level in get_upload_levels(metadata):
+            uploads = []
+            for name in level:
+                table = get_table_name(name)
+                table_metadata = deepcopy(metadata)
+                table_metadata["resources"] = [resources[name]]
+                uploads.append(
+                    upload_table(
+                        session,
+                        limit,
+                        url,
+                        table,
+                        get_table_schema(resources[name]),
+                        get_records(data[keys[table]]),
+                        table_metadata,
+                    )
+                )
+            await asyncio.gather(*uploads)
+
+
+def main(filename: str | None = None, download_date: tuple | None = None):
+    token = environ.get("OEP_API_TOKEN") or getpass("Enter your OEP API token:")
+    data, filenames, metadata, (_, _, _) = get_renamed_normalised(
+        filename=filename, download_date=download_date, oep=True
+    )
+    asyncio.run(publish_normalised(data, filenames, metadata, token, OEP_URL))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+from os import path, mkdir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+REGISTRYDIR = "registry"
+REGISTRY_FILENAME = "{kind}_keys.csv"
+REGISTRY_KINDS = ["operator", "socket", "address", "coordinate"]
+
+
+def get_registry_path(kind: str, registry_dir: str = REGISTRYDIR):
+    """Return the path of the registry file of a key kind."""
+    if kind not in REGISTRY_KINDS:
+        raise ValueError(f"Unknown registry kind {kind}, use one of {REGISTRY_KINDS}")
+    return path.join(registry_dir, REGISTRY_FILENAME.format(kind=kind))
+
+
+def load_registry(kind: str, registry_dir: str = REGISTRYDIR):
+    """Load the registry of a key kind as a dictionary from key to id."""
+    file_path = get_registry_path(kind, registry_dir)
+    if not path.exists(file_path):
+        return {}
+    registry = pd.read_csv(
+        file_path,
+        dtype={"key": str, "id": "int64"},
+        keep_default_na=False,
+        encoding="utf-8",
+    )
+    return dict(zip(registry["key"], registry["id"]))
+
+
+def register_keys(registry: dict, keys, kind: str, registry_dir: str = REGISTRYDIR):
+    """Append unseen keys to the registry file and return the updated registry."""
+    new_keys = sorted(set(k for k in keys if k not in registry))
+    if not new_keys:
+        return registry
+    if not path.exists(registry_dir):
+        mkdir(registry_dir)
+    start = max(registry.values(), default=-1) + 1
+    new_entries = pd.DataFrame(
+        {"key": new_keys, "id": range(start, start + len(new_keys))}
+    )
+    file_path = get_registry_path(kind, registry_dir)
+    new_entries.to_csv(
+        file_path,
+        mode="a",
+        header=not path.exists(file_path),
+        index=False,
+        encoding="utf-8",
+    )
+    registry.update(zip(new_entries["key"], new_entries["id"]))
+    return registry
+
+
+def get_stable_ids(values, kind: str, registry_dir: str = REGISTRYDIR):
+    """
+    Map a column of keys to the integer ids of the registry.
+
+    Keys that were never seen before are appended to the registry, so an id
+    once assigned stays the same in every later snapshot. Missing values stay missing.
+    """
+    keys = values[values.notna()].astype(str)
+    registry = load_registry(kind, registry_dir)
+    registry = register_keys(registry, keys.unique(), kind, registry_dir)
+    return keys.map(registry).reindex(values.index).astype("Int64")
@@ -4,14 +4,36 @@
 from pathlib import Path
 from .normalise import get_normalised_data
 from .annotate import annotate
-import json
+from .keys import KEY_FILENAME
+from .output import write_csv, write_json
+from .dates import DATETIME_FORMAT
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 
 DEBUG = False
 OEP = False  # The OEP format is not entirely compatible with frictionless, change to False to generate a frictionless dataset.
 
 DEFAULT_DIR = "default"
+BUNDLE_DIR = "data"
+BUNDLE_DIRNAME = "DE-{yyyy}{mm}{dd}-BNETZA-BNETZA"
 OEP_NORMAL_FILENAME = "bnetza_charging_stations_normalised_{dd}_{mm}_{yyyy}"
 OEP_REGULAR_FILEANAME = "bnetza_charging_stations_{dd}_{mm}_{yyyy}"
+# Names of the normalised resources in the order of the bundle
+RESOURCE_FILENAMES = {
+    "column": "bnetza_charging_columns_{dd}_{mm}_{yyyy}",
+    "facility": "bnetza_charging_facilities_{dd}_{mm}_{yyyy}",
+    "point": "bnetza_charging_points_{dd}_{mm}_{yyyy}",
+    "operator": "bnetza_operators_{dd}_{mm}_{yyyy}",
+    "geolocation": "bnetza_geolocations_{dd}_{mm}_{yyyy}",
+    "socket": "bnetza_charging_sockets_{dd}_{mm}_{yyyy}",
+    "compatibility": "bnetza_charging_compatibility_{dd}_{mm}_{yyyy}",
+    "address": "bnetza_addresses_{dd}_{mm}_{yyyy}",
+    "coordinate": "bnetza_coordinates_{dd}_{mm}_{yyyy}",
+    "key": KEY_FILENAME,
+}
 
 COLUMN_RENAME = {
     "Betreiber": "operator",
@@ -38,30 +60,33 @@ COLUMN_RENAME = {
     "Anzahl Ladepunkte": "charger_amount",
     "Steckertypen1": "charger_type_1",
     "Nennleistung Stecker1": "charger_power_1",
-    "Public Key1": "charger_public_key_1",
+    "Public Key ID1": "charger_public_key_id_1",
     "EVSE-ID1": "evse_id_1",
     "Steckertypen2": "charger_type_2",
     "Nennleistung Stecker2": "charger_power_2",
-    "Public Key2": "charger_public_key_2",
+    "Public Key ID2": "charger_public_key_id_2",
     "EVSE-ID2": "evse_id_2",
     "Steckertypen3": "charger_type_3",
     "Nennleistung Stecker3": "charger_power_3",
-    "Public Key3": "charger_public_key_3",
+    "Public Key ID3": "charger_public_key_id_3",
     "EVSE-ID3": "evse_id_3",
     "Steckertypen4": "charger_type_4",
     "Nennleistung Stecker4": "charger_power_4",
-    "Public Key4": "charger_public_key_4",
+    "Public Key ID4": "charger_public_key_id_4",
     "EVSE-ID4": "evse_id_4",
     "Steckertypen5": "charger_type_5",
     "Nennleistung Stecker5": "charger_power_5",
-    "Public Key5": "charger_public_key_5",
+    "Public Key ID5": "charger_public_key_id_5",
     "EVSE-ID5": "evse_id_5",
     "Steckertypen6": "charger_type_6",
     "Nennleistung Stecker6": "charger_power_6",
-    "Public Key6": "charger_public_key_6",
+    "Public Key ID6": "charger_public_key_id_6",
     "EVSE-ID6": "evse_id_6",
+    "Fingerabdruck": "fingerprint",
     "Steckertypen": "charger_type",
     "Leistungskapazität": "charger_power",
+    "Public Key ID": "public_key_id",
+    "EVSE-ID": "evse_id",
     "PublicKey": "public_key",
 }
 
@@ -81,6 +106,7 @@ COLUMN_DATATYPE = {
     "Längengrad": "float",
     "Nennleistung Ladeeinrichtung [kW]": "float",
     "Anzahl Ladepunkte": "integer",
+    "Fingerabdruck": "integer",
     "Nennleistung Stecker1": "float",
     "Nennleistung Stecker2": "float",
     "Nennleistung Stecker3": "float",
@@ -139,48 +165,95 @@ def process_resource(resource, data, filename, oep):
     update_metadata(resource, filename, oep)
 
 
+def rename_columns(df):
+    """Rename the columns of a frame using COLUMN_RENAME, without copying the data."""
+    df.columns = [COLUMN_RENAME.get(c, c) for c in df.columns]
+
+
+def replace_substrings(value, mapping: dict):
+    """Replace every key of the mapping in a value by its value."""
+    if not isinstance(value, str):
+        return value
+    for old, new in mapping.items():
+        value = value.replace(old, new)
+    return value
+
+
+def map_values(values, function):
+    """
+    Apply a function to the values of a column.
+
+    The function is applied once to every distinct value, not to every row.
+    """
+    codes, uniques = pd.factorize(values)
+    # The last value is taken by the missing values, coded as -1
+    mapped = np.array([function(v) for v in uniques] + [np.nan], dtype=object)
+    return pd.Series(mapped[codes], index=values.index, name=values.name)
+
+
 def rename_data_columns(data):
     """Rename columns in the data using COLUMN_RENAME."""
     for key in data.keys():
-        data[key] = data[key].rename(columns=COLUMN_RENAME)
+        rename_columns(data[key])
         if key == "column":
-            for k, v in CONTENT_RENAME_TYPE.items():
-                data[key]["column_type"] = data[key]["column_type"].str.replace(k, v)
-            for k, v in COLUMN_OPERATION_STATUS.items():
-                data[key]["status"] = data[key]["status"].str.replace(k, v)
+            column = data[key]
+            column["column_type"] = map_values(
+                column["column_type"],
+                lambda x: replace_substrings(x, CONTENT_RENAME_TYPE),
+            )
+            column["status"] = map_values(
+                column["status"],
+                lambda x: replace_substrings(x, COLUMN_OPERATION_STATUS),
+            )
         if key == "facility":
-            data[key]["opening_times"] = data[key]["opening_times"].apply(
-                lambda x: OPENING_HOURS_MAP.get(x, x)
+            data[key]["opening_times"] = map_values(
+                data[key]["opening_times"], lambda x: OPENING_HOURS_MAP.get(x, x)
             )
 
 
-def process_all_resources(data, normalised_compiled_metadata, oep, dd, mm, yyyy):
-    """Process all resources and return updated filenames."""
-    resource_filenames = [
-        ("column", f"bnetza_charging_columns_{dd}_{mm}_{yyyy}"),
-        ("facility", f"bnetza_charging_facilities_{dd}_{mm}_{yyyy}"),
-        ("point", f"bnetza_charging_points_{dd}_{mm}_{yyyy}"),
-        ("operator", f"bnetza_operators_{dd}_{mm}_{yyyy}"),
-        ("geolocation", f"bnetza_geolocations_{dd}_{mm}_{yyyy}"),
-        ("socket", f"bnetza_charging_sockets_{dd}_{mm}_{yyyy}"),
-        ("compatibility", f"bnetza_charging_compatibility_{dd}_{mm}_{yyyy}"),
-        ("address", f"bnetza_addresses_{dd}_{mm}_{yyyy}"),
-        ("coordinate", f"bnetza_coordinates_{dd}_{mm}_{yyyy}"),
-    ]
+def update_foreign_keys(resources, resource_names):
+    """Point foreign key references to the renamed resources and fields."""
+    for resource in resources:
+        for foreign_key in resource["schema"].get("foreignKeys", []):
+            foreign_key["fields"] = [
+                COLUMN_RENAME.get(f, f) for f in foreign_key["fields"]
+            ]
+            reference = foreign_key["reference"]
+            reference["resource"] = resource_names.get(
+                reference["resource"], reference["resource"]
+            )
 
-    for i, (key, filename) in enumerate(resource_filenames):
-        process_resource(
-            normalised_compiled_metadata["resources"][i], data[key], filename, oep
-        )
 
-    return {key: filename for key, filename in resource_filenames}
+def process_all_resources(
+    data, filenames, normalised_compiled_metadata, oep, dd, mm, yyyy
+):
+    """
+    Process all resources and return updated filenames.
+
+    The resources are matched to the tables by the names normalise gave them.
+    """
+    resources = {r["name"]: r for r in normalised_compiled_metadata["resources"]}
+    new_filenames = {
+        key: template.format(dd=dd, mm=mm, yyyy=yyyy)
+        for key, template in RESOURCE_FILENAMES.items()
+    }
+
+    resource_names = {}
+    for key, filename in new_filenames.items():
+        resource = resources[filenames[key]]
+        process_resource(resource, data[key], filename, oep)
+        resource_names[filenames[key]] = resource["name"]
+    update_foreign_keys(normalised_compiled_metadata["resources"], resource_names)
+
+    return new_filenames
 
 
 def get_renamed_normalised(
     filename: str | None = None, download_date: tuple | None = None, oep=True
 ):
+    # The renamed tables are written or published, so they include the keys
     data, filenames, normalised_compiled_metadata, (dd, mm, yyyy) = get_normalised_data(
-        filename, download_date
+        filename, download_date, public_keys=True
     )
 
     # Rename data columns
@@ -188,7 +261,7 @@ def get_renamed_normalised(
 
     # Process all resources
     new_filenames = process_all_resources(
-        data, normalised_compiled_metadata, oep, dd, mm, yyyy
+        data, filenames, normalised_compiled_metadata, oep, dd, mm, yyyy
     )
 
     # Update metadata
@@ -210,10 +283,11 @@ def get_renamed_annotated(
         annotate(filename, download_date)
     )
 
-    station_data = station_data.rename(columns=COLUMN_RENAME)
-
-    for k, v in CONTENT_RENAME_TYPE.items():
-        station_data["column_type"] = station_data["column_type"].str.replace(k, v)
+    rename_columns(station_data)
+    station_data["column_type"] = map_values(
+        station_data["column_type"],
+        lambda x: replace_substrings(x, CONTENT_RENAME_TYPE),
+    )
 
     if oep:
         station_data.index.name = "id"
@@ -261,6 +335,12 @@ def get_renamed_annotated(
         if oep
         else station_compiled_metadata["resources"][0]["name"]
     )
+    # The key table
+    for resource in station_compiled_metadata["resources"][1:]:
+        for field in resource["schema"]["fields"]:
+            field["name"] = COLUMN_RENAME.get(field["name"], field["name"])
+        if oep:
+            resource["name"] = "model_draft." + resource["name"]
 
     station_compiled_metadata["name"] = OEP_REGULAR_FILEANAME.format(
         mm=mm, dd=dd, yyyy=yyyy
@@ -275,6 +355,19 @@ def get_renamed_annotated(
     return station_data, station_filename, station_compiled_metadata, (dd, mm, yyyy)
 
 
+def get_latest_bundle():
+    """Return the directory of the latest normalised bundle."""
+    bundle_dir = get_output_dir(BUNDLE_DIR)
+    bundles = sorted(
+        Path(bundle_dir).glob(BUNDLE_DIRNAME.format(yyyy="*", mm="", dd=""))
+    )
+    if not bundles:
+        raise IOError(
+            f"No bundle found in {bundle_dir}. Write one with parser/rename.py first."
+        )
+    return bundles[-1]
+
+
 def get_renamed_bnetza(
     output_path: str,
     filename: str | None = None,
@@ -283,44 +376,52 @@ def get_renamed_bnetza(
     data, filenames, normalised_compiled_metadata, (dd, mm, yyyy) = (
         get_renamed_normalised(filename=filename, download_date=download_date, oep=OEP)
     )
-    output_name = Path(f"{output_path}").joinpath(f"DE-{yyyy}{mm}{dd}-BNETZA-BNETZA")
+    output_name = Path(get_output_dir(output_path)).joinpath(
+        BUNDLE_DIRNAME.format(yyyy=yyyy, mm=mm, dd=dd)
+    )
     if not output_name.exists():
         output_name.mkdir(exist_ok=True, parents=True)
     if not DEBUG:
         for element in data.keys():
-            data[element].to_csv(
+            write_csv(
+                data[element],
                 output_name.joinpath(f"{filenames[element]}.csv"),
-                date_format="%Y-%m-%d %H:%M:%S",
+                date_format=DATETIME_FORMAT,
             )
 
-        with open(
+        write_json(
+            normalised_compiled_metadata,
             output_name.joinpath(
                 f"{OEP_NORMAL_FILENAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json"
             ),
-            "w",
-            encoding="utf8",
-        ) as output:
-            json.dump(
-                normalised_compiled_metadata, output, indent=4, ensure_ascii=False
-            )
+            indent=4,
+            ensure_ascii=False,
+        )
 
     station_data, station_filename, station_compiled_metadata, (dd, mm, yyyy) = (
         get_renamed_annotated(filename=filename, download_date=download_date, oep=OEP)
     )
 
-    if not (p := Path(f"{DEFAULT_DIR}")).exists():
+    default_dir = get_output_dir(DEFAULT_DIR)
+    if not (p := Path(default_dir)).exists():
         p.mkdir(parents=True, exist_ok=True)
     if DEBUG:
         station_data = station_data.head(10)
-    station_data.to_csv(
-        f"{DEFAULT_DIR}/{station_filename}.csv",
+    write_csv(
+        station_data,
+        f"{default_dir}/{station_filename}.csv",
         index=OEP,
-        date_format="%Y-%m-%d %H:%M:%S",
+        date_format=DATETIME_FORMAT,
     )
 
-    with open(
-        f"{DEFAULT_DIR}/{OEP_REGULAR_FILEANAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json",
-        "w",
-        encoding="utf8",
-    ) as output:
-        json.dump(station_compiled_metadata, output, indent=4, ensure_ascii=False)
+    write_csv(
+        data["key"],
+        f"{default_dir}/{KEY_FILENAME.format(dd=dd, mm=mm, yyyy=yyyy)}.csv",
+    )
+
+    write_json(
+        station_compiled_metadata,
+        f"{default_dir}/{OEP_REGULAR_FILEANAME.format(mm=mm, dd=dd, yyyy=yyyy)}.json",
+        indent=4,
+        ensure_ascii=False,
+    )
@@ -0,0 +1,319 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Serve read-only queries over the latest normalised snapshot as JSON.
+
+The tables are loaded once and indexed by postcode, operator and facility. Every
+snapshot has an LRU cache of its responses keyed by path, a request takes the
+snapshot and its cache together, so a new snapshot is swapped in while requests
+are served and never gets stale answers.
+
+GET /postcode/<postcode>   columns of a postcode with address, coordinates and operator
+GET /operator/<id>         columns of an operator
+GET /facility/<id>         facility with its columns, points and sockets
+GET /metrics               latency, cache hit rate and snapshot
+POST /reload               loads the latest snapshot in the background and swaps it in
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from functools import lru_cache, partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import environ
+from urllib.parse import unquote, urlsplit
+from .normalise import get_normalised_data
+from .publish_normalised import get_records
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+HOST = environ.get("BNETZA_HOST", "127.0.0.1")
+PORT = int(environ.get("BNETZA_PORT", "8765"))
+CACHE_SIZE = 4096
+# Number of recent requests the latency percentiles are computed from
+LATENCY_WINDOW = 10000
+POSTCODE_LENGTH = 5
+
+
+def get_stations(data):
+    """Join the columns with their address, coordinates and operator."""
+    geolocation = (
+        data["geolocation"]
+        .join(data["address"], on="address_id")
+        .join(data["coordinate"], on="coordinate_id")
+        .drop(columns=["address_id", "coordinate_id"])
+    )
+    operator = data["facility"][["operator_id"]].join(
+        data["operator"], on="operator_id"
+    )
+    return (
+        data["column"]
+        .join(geolocation, on="geolocation_id")
+        .join(operator, on="facility_id")
+    )
+
+
+def get_postcodes(values):
+    """Return postcodes as strings with their leading zeros."""
+    return values.astype("string").str.strip().str.zfill(POSTCODE_LENGTH)
+
+
+def get_snapshot(data, date: tuple):
+    """Build the stations view and the indexes of the positions of the rows."""
+    stations = get_stations(data)
+    return {
+        "date": "-".join(reversed(date)),
+        "version": time.time_ns(),
+        "tables": data,
+        "stations": stations,
+        "indexes": {
+            "postcode": stations.groupby(
+                get_postcodes(stations["Postleitzahl"]).to_numpy(), sort=False
+            ).indices,
+            "operator": stations.groupby("operator_id", sort=False).indices,
+            "facility": stations.groupby("facility_id", sort=False).indices,
+            "point": data["point"].groupby("column_id", sort=False).indices,
+            "compatibility": data["compatibility"]
+            .groupby("point_id", sort=False)
+            .indices,
+        },
+    }
+
+
+def get_key(index, value: str):
+    """Convert a key of a path to the type of an index, None if it cannot be one."""
+    if pd.api.types.is_integer_dtype(index.dtype):
+        # isdigit accepts digits like "²" that int does not
+        return int(value) if value.isdecimal() else None
+    return value
+
+
+def get_positions(index: dict, key):
+    """Return the positions of the rows of a key, empty for unknown keys."""
+    return index.get(key, np.array([], dtype="int64"))
+
+
+def query_postcode(snapshot, postcode: str):
+    positions = get_positions(
+        snapshot["indexes"]["postcode"], postcode.strip().zfill(POSTCODE_LENGTH)
+    )
+    return {
+        "postcode": postcode,
+        "columns": get_records(snapshot["stations"].iloc[positions]),
+    }
+
+
+def query_operator(snapshot, operator_id: str):
+    operator = snapshot["tables"]["operator"]
+    key = get_key(operator.index, operator_id)
+    if key not in operator.index:
+        return None
+    positions = get_positions(snapshot["indexes"]["operator"], key)
+    return {
+        "operator": get_records(operator.loc[[key]])[0],
+        "columns": get_records(snapshot["stations"].iloc[positions]),
+    }
+
+
+def query_facility(snapshot, facility_id: str):
+    tables = snapshot["tables"]
+    facility = tables["facility"]
+    key = get_key(facility.index, facility_id)
+    if key not in facility.index:
+        return None
+    columns = snapshot["stations"].iloc[
+        get_positions(snapshot["indexes"]["facility"], key)
+    ]
+    points = tables["point"].iloc[
+        np.concatenate(
+            [get_positions(snapshot["indexes"]["point"], c) for c in columns.index]
+            or [np.array([], dtype="int64")]
+        )
+    ]
+    compatibility = tables["compatibility"].iloc[
+        np.concatenate(
+            [
+                get_positions(snapshot["indexes"]["compatibility"], p)
+                for p in points.index
+            ]
+            or [np.array([], dtype="int64")]
+        )
+    ]
+    sockets = tables["socket"].loc[compatibility["socket_id"].dropna().unique()]
+    return {
+        "facility": get_records(facility.loc[[key]])[0],
+        "columns": get_records(columns),
+        "points": get_records(points),
+        "compatibility": get_records(compatibility),
+        "sockets": get_records(sockets),
+    }
+
+
+QUERIES = {
+    "postcode": query_postcode,
+    "operator": query_operator,
+    "facility": query_facility,
+}
+
+
+def encode(obj):
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def get_response(snapshot, path: str):
+    """Return the status and body of a query path on a snapshot."""
+    parts = [p for p in path.split("/") if p]
+    if len(parts) != 2 or parts[0] not in QUERIES:
+        return 404, encode({"error": f"Unknown query {path}"})
+    result = QUERIES[parts[0]](snapshot, parts[1])
+    if result is None:
+        return 404, encode({"error": f"No {parts[0]} {parts[1]}"})
+    return 200, encode(result)
+
+
+class QueryService:
+    """Answer the queries of the current snapshot and record their metrics."""
+
+    def __init__(self, snapshot, loader=None):
+        self.loader = loader
+        self.reloading = threading.Lock()
+        self.metrics_lock = threading.Lock()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.requests = defaultdict(int)
+        # Cache hits and misses of the previous snapshots
+        self.cache_totals = [0, 0]
+        # Error of the last reload, None if it succeeded
+        self.reload_error = None
+        self.set_snapshot(snapshot)
+
+    def set_snapshot(self, snapshot):
+        """Make a snapshot current with a response cache of its own."""
+        self.cached_response = lru_cache(maxsize=CACHE_SIZE)(
+            partial(get_response, snapshot)
+        )
+        self.snapshot = snapshot
+
+    def query(self, path: str):
+        start = time.perf_counter()
+        # The cache is bound to its snapshot, a query in flight during a swap
+        # answers and caches with the previous snapshot only
+        status, body = self.cached_response(path)
+        name = path.strip("/").split("/")[0]
+        name = name if name in QUERIES else "unknown"
+        with self.metrics_lock:
+            self.requests[name] += 1
+            self.latencies[name].append(time.perf_counter() - start)
+        return status, body
+
+    def swap(self, snapshot):
+        """Replace the snapshot without interrupting the queries being served."""
+        cache = self.cached_response.cache_info()
+        self.set_snapshot(snapshot)
+        with self.metrics_lock:
+            self.cache_totals[0] += cache.hits
+            self.cache_totals[1] += cache.misses
+
+    def reload(self):
+        """Load a new snapshot and swap it in, False if a reload is already running."""
+        if not self.reloading.acquire(blocking=False):
+            return False
+        try:
+            self.swap(self.loader())
+            self.reload_error = None
+        except Exception as error:
+            # The reload runs in its own thread, the error is reported in the metrics
+            self.reload_error = f"{type(error).__name__}: {error}"
+        finally:
+            self.reloading.release()
+        return True
+
+    def get_metrics(self):
+        cache = self.cached_response.cache_info()
+        with self.metrics_lock:
+            hits = self.cache_totals[0] + cache.hits
+            misses = self.cache_totals[1] + cache.misses
+            latencies = {
+                name: {
+                    "requests": self.requests[name],
+                    **{
+                        f"p{q}_ms": round(float(np.percentile(values, q)) * 1000, 3)
+                        for q in (50, 95, 99)
+                    },
+                }
+                for name, values in self.latencies.items()
+            }
+        return {
+            "snapshot": self.snapshot["date"],
+            "version": self.snapshot["version"],
+            "reloading": self.reloading.locked(),
+            "reload_error": self.reload_error,
+            "cache": {
+                "size": cache.currsize,
+                "max_size": cache.maxsize,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            },
+            "latency": latencies,
+        }
+
+
+def get_handler(service: QueryService):
+    """Return the request handler class serving a query service."""
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def send(self, status: int, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = unquote(urlsplit(self.path).path)
+            try:
+                if path == "/metrics":
+                    response = 200, encode(service.get_metrics())
+                else:
+                    response = service.query(path)
+            except Exception as error:
+                response = 500, encode({"error": f"{type(error).__name__}: {error}"})
+            self.send(*response)
+
+        def do_POST(self):
+            if self.path != "/reload":
+                self.send(404, encode({"error": f"Unknown path {self.path}"}))
+            elif service.loader is None or service.reloading.locked():
+                self.send(409, encode({"error": "Reload not possible"}))
+            else:
+                threading.Thread(target=service.reload, daemon=True).start()
+                self.send(202, encode({"reloading": True}))
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+def load_snapshot(filename: str | None = None, download_date: tuple | None = None):
+    data, _, _, date = get_normalised_data(filename, download_date)
+    return get_snapshot(data, date)
+
+
+def main():
+    service = QueryService(load_snapshot(), loader=load_snapshot)
+    server = ThreadingHTTPServer((HOST, PORT), get_handler(service))
+    server.daemon_threads = True
+    print(f"Serving the snapshot of {service.snapshot['date']} on http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
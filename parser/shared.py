@@ -0,0 +1,165 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Share the cleaned frame with worker processes without pickling it.
+
+A frame is published as a directory with one .npy file per column, in shared
+memory where the system has it. Workers get the path and attach the frame by
+memory mapping its columns, so all processes read the same pages and nothing is
+copied. Text columns are stored as codes of their distinct values and attached
+as categoricals of them, only the distinct values are read into memory. Their
+original type, object or string, is restored with restore_dtypes at the cost of
+a copy of every text column.
+The columns are mapped copy-on-write, a worker changing a frame changes its own
+pages and never the published files.
+"""
+
+import atexit
+import json
+import pickle
+import tempfile
+from contextlib import contextmanager
+from os import path
+from shutil import rmtree
+from .clean import get_clean_data
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# Directory of the published frames, the default temporary directory if None
+SHARED_DIR = "/dev/shm" if path.isdir("/dev/shm") else None
+SHARED_PREFIX = "bnetza_shared_"
+MANIFEST_FILENAME = "manifest.json"
+INDEX = "__index__"
+# Smallest integer types of the codes of text columns, as used by categoricals
+CODE_TYPES = ["int8", "int16", "int32", "int64"]
+
+
+def get_code_type(categories: int):
+    """Return the smallest integer type holding the codes of a number of categories."""
+    return next(t for t in CODE_TYPES if categories < np.iinfo(t).max)
+
+
+def write_column(values, directory: str, name: str):
+    """Write the arrays of a column and return its entry of the manifest."""
+    file_path = path.join(directory, name)
+    dtype = values.dtype
+    if pd.api.types.is_object_dtype(dtype) or isinstance(
+        dtype, (pd.CategoricalDtype, pd.StringDtype)
+    ):
+        codes, uniques = pd.factorize(values)
+        np.save(f"{file_path}.npy", codes.astype(get_code_type(len(uniques))))
+        with open(f"{file_path}.pkl", "wb") as f:
+            pickle.dump(pd.Index(uniques, dtype=object), f)
+        return {"kind": "text", "dtype": str(dtype)}
+    if pd.api.types.is_extension_array_dtype(dtype) and hasattr(dtype, "numpy_dtype"):
+        # Nullable integers, floats and booleans are stored with their mask
+        np.save(
+            f"{file_path}.npy",
+            values.to_numpy(
+                dtype=dtype.numpy_dtype, na_value=dtype.numpy_dtype.type(0)
+            ),
+        )
+        np.save(f"{file_path}_mask.npy", values.isna().to_numpy())
+        return {"kind": "masked", "dtype": str(dtype)}
+    np.save(f"{file_path}.npy", values.to_numpy())
+    return {"kind": "numpy"}
+
+
+def read_column(entry: dict, directory: str, name: str, restore_dtype: bool = False):
+    """
+    Attach the arrays of a column by memory mapping them.
+
+    Text columns are categoricals, with restore_dtype they are converted back.
+    """
+    file_path = path.join(directory, name)
+    data = np.load(f"{file_path}.npy", mmap_mode="c")
+    if entry["kind"] == "masked":
+        mask = np.load(f"{file_path}_mask.npy", mmap_mode="c")
+        array_type = pd.api.types.pandas_dtype(entry["dtype"]).construct_array_type()
+        return array_type(data, mask)
+    if entry["kind"] == "text":
+        with open(f"{file_path}.pkl", "rb") as f:
+            categories = pickle.load(f)
+        values = pd.Categorical.from_codes(data, categories=categories)
+        return pd.array(values, dtype=entry["dtype"]) if restore_dtype else values
+    return data
+
+
+def publish_frame(df, directory: str | None = SHARED_DIR):
+    """
+    Publish a frame for other processes and return its path.
+
+    The frame is removed by remove_frame, or when the publishing process exits.
+    """
+    shared_path = tempfile.mkdtemp(prefix=SHARED_PREFIX, dir=directory)
+    atexit.register(remove_frame, shared_path)
+    try:
+        manifest = {"columns": [], "entries": {}}
+        columns = {INDEX: pd.Series(df.index)}
+        # Columns are written by position, their names may not be file names
+        columns.update((str(i), df.iloc[:, i]) for i in range(df.shape[1]))
+        for name, values in columns.items():
+            manifest["entries"][name] = write_column(values, shared_path, name)
+        manifest["columns"] = list(df.columns)
+        manifest["index_name"] = df.index.name
+        # The manifest is written last, a frame without it is incomplete
+        with open(path.join(shared_path, MANIFEST_FILENAME), "w") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+    except BaseException:
+        remove_frame(shared_path)
+        raise
+    return shared_path
+
+
+def attach_frame(shared_path: str, restore_dtypes: bool = False):
+    """
+    Return a published frame, its columns are memory mapped and not copied.
+
+    Text columns are attached as categoricals, unless restore_dtypes is set.
+    """
+    with open(path.join(shared_path, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+    entries = manifest["entries"]
+    index = pd.Index(
+        read_column(entries[INDEX], shared_path, INDEX, restore_dtypes),
+        name=manifest["index_name"],
+        copy=False,
+    )
+    columns = {
+        i: read_column(entries[str(i)], shared_path, str(i), restore_dtypes)
+        for i in range(len(manifest["columns"]))
+    }
+    df = pd.DataFrame(columns, index=index, copy=False)
+    df.columns = manifest["columns"]
+    return df
+
+
+def remove_frame(shared_path: str):
+    """Remove a published frame, attached frames stay readable until released."""
+    rmtree(shared_path, ignore_errors=True)
+
+
+@contextmanager
+def shared_frame(df, directory: str | None = SHARED_DIR):
+    """Publish a frame for the duration of the context and yield its path."""
+    shared_path = publish_frame(df, directory)
+    try:
+        yield shared_path
+    finally:
+        remove_frame(shared_path)
+
+
+@contextmanager
+def shared_clean_data(filename: str | None = None, download_date: tuple | None = None):
+    """
+    Publish the cleaned data for the duration of the context.
+
+    Yields the path of the published frame, the name and the date of the snapshot
+    like get_clean_data. Workers attach the frame with attach_frame.
+    """
+    df, filename, date = get_clean_data(filename, download_date)
+    with shared_frame(df) as shared_path:
+        yield shared_path, filename, date
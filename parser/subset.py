@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Run the pipeline on a subset of the charging columns.
+
+The subset is applied right after the cleaned data is loaded, so every later
+stage only sees the subset. Its outputs are written below subset/<name>/ to keep
+them apart from the full dataset. Set the subset with set_subset or as JSON in
+the environment variable BNETZA_SUBSET, e.g.
+BNETZA_SUBSET='{"federal_states": ["Berlin"], "fraction": 0.1}'.
+"""
+
+import hashlib
+import json
+from os import environ, path
+
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+SUBSET_ENV = "BNETZA_SUBSET"
+SUBSET_DIR = "subset"
+SUBSET_COLUMNS = {
+    "federal_states": "Bundesland",
+    "operators": "Betreiber",
+    "ids": "Ladeeinrichtungs-ID",
+}
+DEFAULT_SEED = 42
+
+SUBSET = json.loads(environ[SUBSET_ENV]) if environ.get(SUBSET_ENV) else None
+
+
+def set_subset(
+    federal_states: list | None = None,
+    operators: list | None = None,
+    fraction: float | None = None,
+    seed: int = DEFAULT_SEED,
+    ids: list | None = None,
+):
+    """
+    Restrict all stages to the columns matching every given filter.
+
+    The fraction samples the remaining columns with a fixed seed. Without
+    arguments, the subset mode is switched off.
+    """
+    global SUBSET
+    subset = {
+        "federal_states": federal_states,
+        "operators": operators,
+        "ids": ids,
+        "fraction": fraction,
+    }
+    subset = {k: v for k, v in subset.items() if v is not None}
+    if fraction is not None:
+        subset["seed"] = seed
+    SUBSET = subset or None
+
+
+def get_subset_name():
+    """Return a short name that identifies the subset."""
+    text = json.dumps(SUBSET, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:8]
+
+
+def get_output_dir(directory: str):
+    """Return the directory of a stage output, a separate one for every subset."""
+    if SUBSET is None:
+        return directory
+    return path.join(SUBSET_DIR, get_subset_name(), directory)
+
+
+def describe_subset():
+    """Return the description of the subset for the metadata, empty without subset."""
+    if SUBSET is None:
+        return ""
+    filters = ", ".join(f"{k}: {v}" for k, v in SUBSET.items())
+    return f" Subset of the charging columns ({filters})."
+
+
+def apply_subset(df):
+    """Return the rows of the cleaned data in the subset, all rows without subset."""
+    if SUBSET is None:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for key, column in SUBSET_COLUMNS.items():
+        if key in SUBSET:
+            values = df[column].str.strip() if key == "operators" else df[column]
+            mask &= values.isin(SUBSET[key])
+    df = df[mask]
+    if "fraction" in SUBSET:
+        df = df.sample(
+            frac=SUBSET["fraction"], random_state=SUBSET.get("seed", DEFAULT_SEED)
+        ).sort_index()
+    return df.reset_index(drop=True)
@@ -0,0 +1,249 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Precompute a pyramid of clusters of the charging columns for the map.
+
+Every zoom level divides the web mercator tiles into a grid of cells, the
+columns of a cell form a cluster with its centroid, counts and capacity, in
+total and by connector type. The clusters are written as JSON chunks of
+neighbouring tiles, keyed by the z/x/y key of their tile, so a viewport is read
+with one or a few small requests. The index lists the chunks of every zoom level.
+
+The facts the pyramid is built from are stored with it. When few facts changed
+since the previous snapshot, only the chunks containing a changed fact are
+written again.
+"""
+
+from glob import glob
+from os import path
+from pathlib import Path
+from .aggregate import INCREMENTAL_THRESHOLD, MEASURES, get_fact_delta, get_facts
+from .normalise import get_normalised_data
+from .output import batch_manifests, remove_output, write_csv, write_json
+from .subset import get_output_dir
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+TILEDIR = "tiles"
+FACT_FILENAME = "bnetza_tile_facts.csv"
+INDEX_FILENAME = "index.json"
+CHUNK_PATH = "{z}/{x}/{y}.json"
+
+MIN_ZOOM = 0
+# Above this zoom level the map draws the columns themselves
+MAX_ZOOM = 14
+# A tile has 2**CELL_BITS cells per side, 64 cells of 4 pixels of a 256 pixel tile
+CELL_BITS = 6
+# A chunk has 2**CHUNK_BITS tiles per side, 4 x 4 tiles cover most viewports
+CHUNK_BITS = 2
+# Limit of the latitude of web mercator
+MAX_LATITUDE = 85.0511287798
+# Connector of the fact rows of the columns themselves
+TOTAL = "total"
+POSITION = ["latitude", "longitude"]
+FACT_COLUMNS = ["id", "connector"] + POSITION + MEASURES
+# Fields of a cluster, the last one maps the connector types to their measures
+CLUSTER_FIELDS = ["longitude", "latitude"] + MEASURES + ["connectors"]
+
+
+def get_tile_facts(data):
+    """
+    Return one row per charging column and one per column and connector type
+    with the position of the column, columns without coordinates are left out.
+    """
+    facts = get_facts(data)
+    coordinates = data["geolocation"][["coordinate_id"]].join(
+        data["coordinate"], on="coordinate_id"
+    )
+    # A column is drawn at one position
+    coordinates = coordinates[~coordinates.index.duplicated()]
+    position = (
+        data["column"][["geolocation_id"]]
+        .join(coordinates, on="geolocation_id")[["Breitengrad", "Längengrad"]]
+        .set_axis(POSITION, axis=1)
+    )
+    tile_facts = pd.concat(
+        [facts["columns"].assign(connector=TOTAL), facts["connectors"]],
+        ignore_index=True,
+    ).join(position, on="id")
+    tile_facts = tile_facts.dropna(subset=POSITION)[FACT_COLUMNS]
+    # Ids are compared with the stored facts as text
+    tile_facts["id"] = tile_facts["id"].astype(str)
+    return tile_facts.sort_values(["id", "connector"], ignore_index=True)
+
+
+def get_cells(facts):
+    """Return the web mercator cells of the facts at the highest zoom level."""
+    scale = 2 ** (MAX_ZOOM + CELL_BITS)
+    latitude = np.radians(facts["latitude"].clip(-MAX_LATITUDE, MAX_LATITUDE))
+    x = (facts["longitude"] + 180) / 360 * scale
+    y = (1 - np.log(np.tan(latitude) + 1 / np.cos(latitude)) / np.pi) / 2 * scale
+    return (
+        np.floor(x).clip(0, scale - 1).to_numpy(dtype="int64"),
+        np.floor(y).clip(0, scale - 1).to_numpy(dtype="int64"),
+    )
+
+
+def get_chunks(cells, zoom: int):
+    """Return the chunks of the cells at a zoom level."""
+    shift = MAX_ZOOM - zoom + CELL_BITS + CHUNK_BITS
+    return cells[0] >> shift, cells[1] >> shift
+
+
+def get_chunk_keys(chunks):
+    """Combine the x and y of chunks into one key."""
+    return (chunks[0] << 32) | chunks[1]
+
+
+def get_clusters(facts, cells, zoom: int):
+    """Return the clusters of the facts at a zoom level, by chunk and tile key."""
+    shift = MAX_ZOOM - zoom
+    x, y = cells[0] >> shift, cells[1] >> shift
+    total = (facts["connector"] == TOTAL).to_numpy()
+    grouped = facts[MEASURES].groupby([x, y, facts["connector"].to_numpy()]).sum()
+    centroids = facts.loc[total, ["longitude", "latitude"]].groupby(
+        [x[total], y[total]]
+    )
+    # Positions are averaged over the columns, the centroid is drawn, not the cell
+    centroids = centroids.mean().round(6)
+
+    is_total = grouped.index.get_level_values(2) == TOTAL
+    connectors = {}
+    for (cx, cy, connector), columns, points, capacity in grouped[
+        ~is_total
+    ].itertuples():
+        connectors.setdefault((cx, cy), {})[connector] = [
+            int(columns),
+            int(points),
+            round(capacity, 3),
+        ]
+
+    chunks = {}
+    totals = grouped[is_total].droplevel(2).join(centroids)
+    for (cx, cy), columns, points, capacity, longitude, latitude in totals.itertuples():
+        tx, ty = cx >> CELL_BITS, cy >> CELL_BITS
+        chunk = chunks.setdefault((tx >> CHUNK_BITS, ty >> CHUNK_BITS), {})
+        chunk.setdefault(f"{zoom}/{tx}/{ty}", []).append(
+            [
+                longitude,
+                latitude,
+                int(columns),
+                int(points),
+                round(capacity, 3),
+                connectors.get((cx, cy), {}),
+            ]
+        )
+    return chunks
+
+
+def get_tile_dir(tile_dir: str | None = None):
+    """Return the tile directory, the one of the subset in subset mode by default."""
+    return get_output_dir(TILEDIR) if tile_dir is None else tile_dir
+
+
+def read_tile_facts(tile_dir: str | None = None):
+    """Read the facts stored with the previous pyramid."""
+    return pd.read_csv(
+        path.join(get_tile_dir(tile_dir), FACT_FILENAME),
+        dtype={"id": str, "connector": str},
+        keep_default_na=False,
+        float_precision="round_trip",
+        encoding="utf-8",
+    ).astype({m: float for m in POSITION + MEASURES})
+
+
+def get_chunk_files(tile_dir: str, zoom: int):
+    """Return the paths of the chunk files of a zoom level."""
+    return set(glob(path.join(tile_dir, str(zoom), "*", "*.json")))
+
+
+def write_pyramid(facts, delta=None, tile_dir: str | None = None):
+    """
+    Write the chunks of every zoom level and return the chunks by zoom level.
+
+    With a fact delta only the chunks containing a changed fact are written,
+    chunks left without clusters are removed.
+    """
+    tile_dir = get_tile_dir(tile_dir)
+    cells = get_cells(facts)
+    changed_cells = get_cells(delta) if delta is not None else None
+    index = {}
+    for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+        keys = get_chunk_keys(get_chunks(cells, zoom))
+        if changed_cells is None:
+            selected = np.ones(len(facts), dtype=bool)
+            stale = get_chunk_files(tile_dir, zoom)
+        else:
+            changed = np.unique(get_chunk_keys(get_chunks(changed_cells, zoom)))
+            selected = np.isin(keys, changed)
+            stale = {
+                path.join(
+                    tile_dir, CHUNK_PATH.format(z=zoom, x=k >> 32, y=k & 0xFFFFFFFF)
+                )
+                for k in changed.tolist()
+            }
+        chunks = get_clusters(
+            facts[selected], (cells[0][selected], cells[1][selected]), zoom
+        )
+        for (x, y), tiles in chunks.items():
+            file_path = path.join(tile_dir, CHUNK_PATH.format(z=zoom, x=x, y=y))
+            write_json(tiles, file_path, ensure_ascii=False, separators=(",", ":"))
+            stale.discard(file_path)
+        for file_path in stale:
+            remove_output(file_path)
+        index[zoom] = sorted(
+            [int(k >> 32), int(k & 0xFFFFFFFF)] for k in np.unique(keys).tolist()
+        )
+    return index
+
+
+def get_pyramid(
+    filename: str | None = None,
+    download_date: tuple | None = None,
+    tile_dir: str | None = None,
+):
+    tile_dir = get_tile_dir(tile_dir)
+    data, _, _, (dd, mm, yyyy) = get_normalised_data(filename, download_date)
+    facts = get_tile_facts(data)
+
+    delta = None
+    if path.exists(path.join(tile_dir, FACT_FILENAME)) and path.exists(
+        path.join(tile_dir, INDEX_FILENAME)
+    ):
+        delta = get_fact_delta(read_tile_facts(tile_dir), facts)
+        if len(delta) > INCREMENTAL_THRESHOLD * len(facts):
+            delta = None
+
+    # The chunks of a directory are listed in its manifest once
+    with batch_manifests():
+        chunks = write_pyramid(facts, delta, tile_dir)
+    index = {
+        "publicationDate": f"{yyyy}-{mm}-{dd}",
+        "minZoom": MIN_ZOOM,
+        "maxZoom": MAX_ZOOM,
+        "cellsPerTile": 2**CELL_BITS,
+        "tilesPerChunk": 2**CHUNK_BITS,
+        "path": CHUNK_PATH,
+        "fields": CLUSTER_FIELDS,
+        "connectors": sorted(set(facts["connector"]) - {TOTAL}),
+        "chunks": chunks,
+    }
+    write_json(
+        index, Path(tile_dir).joinpath(INDEX_FILENAME), indent=4, ensure_ascii=False
+    )
+    write_csv(facts, path.join(tile_dir, FACT_FILENAME), index=False)
+    print(
+        f"Pyramid {'updated' if delta is not None else 'recomputed'} for the snapshot {dd}.{mm}.{yyyy}."
+    )
+    return index
+
+
+def main():
+    get_pyramid()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 German Aerospace Center (DLR)
+# SPDX-License-Identifier: BSD-3-Clause
+
+from .evaluate import get_metadata, write_report
+from .rename import get_latest_bundle
+from pathlib import Path
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+REPORT_VERSION = "integrity"
+
+# Number of offending values quoted in each report entry
+EXAMPLES = 5
+
+INTEGER_PATTERN = r"[+-]?\d+"
+BOOLEAN_VALUES = ["true", "false", "True", "False", "TRUE", "FALSE", "1", "0"]
+
+
+def load_bundle(metadata_path):
+    """
+    Load the metadata of a bundle and all its tables.
+
+    Every value is read as a string, so the type checks see the values as they are written.
+    """
+    metadata = get_metadata(metadata_path)
+    tables = {}
+    for resource in metadata["resources"]:
+        tables[resource["name"]] = pd.read_csv(
+            Path(metadata_path).parent.joinpath(resource["path"]),
+            dtype=str,
+            keep_default_na=False,
+            na_values=[""],
+            encoding="utf-8",
+        )
+    return metadata, tables
+
+
+def get_entry(message, values, schema_path, instance_path):
+    """Build a report entry in the format of the evaluate reports."""
+    examples = list(pd.Series(values).astype(str).unique()[:EXAMPLES])
+    return {
+        "message": f"{message} ({len(values)} rows, e.g. {examples})",
+        "schema_path": schema_path,
+        "instance_path": instance_path,
+    }
+
+
+def get_invalid_types(values, field_type):
+    """Return a mask of the values that cannot be read as the field type."""
+    present = values.notna()
+    if field_type == "integer":
+        valid = values.str.fullmatch(INTEGER_PATTERN)
+    elif field_type in ["number", "float"]:
+        valid = pd.to_numeric(values, errors="coerce").notna()
+    elif field_type in ["date", "datetime"]:
+        valid = pd.to_datetime(values, format="ISO8601", errors="coerce").notna()
+    elif field_type == "boolean":
+        valid = values.isin(BOOLEAN_VALUES)
+    else:
+        return pd.Series(False, index=values.index)
+    return present & ~valid.fillna(False).astype(bool)
+
+
+def check_resource(i, resource, tables):
+    """Check keys, required values and types of a single resource."""
+    report = []
+    name = resource["name"]
+    table = tables[name]
+    schema = resource["schema"]
+    schema_path = ["resources", i, "schema"]
+
+    primary_key = schema.get("primaryKey", [])
+    if isinstance(primary_key, str):
+        primary_key = [primary_key]
+    if primary_key:
+        missing = table[primary_key].isna().any(axis=1)
+        if missing.any():
+            report.append(
+                get_entry(
+                    "Primary key is missing",
+                    table.index[missing],
+                    schema_path + ["primaryKey"],
+                    [name] + primary_key,
+                )
+            )
+        duplicated = table.duplicated(subset=primary_key, keep=False) & ~missing
+        if duplicated.any():
+            report.append(
+                get_entry(
+                    "Primary key is not unique",
+                    table.loc[duplicated, primary_key[0]],
+                    schema_path + ["primaryKey"],
+                    [name] + primary_key,
+                )
+            )
+
+    for j, field in enumerate(schema["fields"]):
+        values = table[field["name"]]
+        field_path = schema_path + ["fields", j]
+        if field.get("constraints", {}).get("required", False):
+            missing = values.isna()
+            if missing.any():
+                report.append(
+                    get_entry(
+                        "Required value is missing",
+                        table.index[missing],
+                        field_path + ["constraints", "required"],
+                        [name, field["name"]],
+                    )
+                )
+        invalid = get_invalid_types(values, field.get("type", "string"))
+        if invalid.any():
+            report.append(
+                get_entry(
+                    f"Value is not of type {field['type']}",
+                    values[invalid],
+                    field_path + ["type"],
+                    [name, field["name"]],
+                )
+            )
+
+    for j, foreign_key in enumerate(schema.get("foreignKeys", [])):
+        fields = foreign_key["fields"]
+        fields = [fields] if isinstance(fields, str) else fields
+        reference = foreign_key["reference"]
+        reference_name = reference["resource"] or name
+        reference_fields = reference["fields"]
+        reference_fields = (
+            [reference_fields]
+            if isinstance(reference_fields, str)
+            else reference_fields
+        )
+        fk_path = schema_path + ["foreignKeys", j]
+        if reference_name not in tables:
+            report.append(
+                {
+                    "message": f"Referenced resource {reference_name} is not in the bundle",
+                    "schema_path": fk_path,
+                    "instance_path": [name] + fields,
+                }
+            )
+            continue
+        # Rows with a missing foreign key do not reference anything
+        keys = table.loc[table[fields].notna().all(axis=1), fields]
+        referenced = pd.MultiIndex.from_frame(tables[reference_name][reference_fields])
+        contained = pd.MultiIndex.from_frame(keys).isin(referenced)
+        if not contained.all():
+            report.append(
+                get_entry(
+                    f"Foreign key is not contained in {reference_name}",
+                    keys.loc[~contained, fields[0]],
+                    fk_path,
+                    [name] + fields,
+                )
+            )
+    return report
+
+
+def validate_bundle(metadata_path):
+    """Check the referential integrity and the constraints of a bundle."""
+    metadata, tables = load_bundle(metadata_path)
+    report = []
+    for i, resource in enumerate(metadata["resources"]):
+        report += check_resource(i, resource, tables)
+    return report
+
+
+def test_integrity(metadata_path):
+    report = validate_bundle(metadata_path)
+    if report:
+        write_report(report, Path(metadata_path).stem, REPORT_VERSION)
+
+    assert not report, (
+        f"The bundle {Path(metadata_path).name} has {len(report)} integrity errors"
+    )
+
+
+def main():
+    for metadata_path in get_latest_bundle().glob("*.json"):
+        test_integrity(metadata_path)
+
+
+if __name__ == "__main__":
+    main()